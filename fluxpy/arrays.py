@@ -0,0 +1,60 @@
+'''
+In-memory stand-ins for HDF5 and Matlab files, so that NumPy arrays (e.g.
+the results of a model run) can be given to a TransformationInterface
+directly, without writing them to a file first; see
+TransformationInterface.from_arrays().
+'''
+
+import numpy as np
+
+class Columns(object):
+    '''
+    A 2-D variable made up of blocks of columns, each a 2-D array (or a 1-D
+    array, which is one column) with the same number of rows. The blocks are
+    not copied; only the rows and columns that are read (e.g. a hyperslab)
+    are copied into a new array, as with an HDF5 dataset.
+    '''
+    def __init__(self, *arrays):
+        self.arrays = [
+            a.reshape((-1, 1)) if a.ndim == 1 else a
+            for a in map(np.asarray, arrays)
+        ]
+        assert len(set([a.shape[0] for a in self.arrays])) == 1, 'Expected arrays with the same number of rows'
+
+        self.dtype = np.result_type(*self.arrays)
+        self.offsets = np.cumsum([0] + [a.shape[1] for a in self.arrays])
+        self.shape = (self.arrays[0].shape[0], int(self.offsets[-1]))
+
+    def __getitem__(self, selection):
+        if selection is Ellipsis:
+            selection = (slice(None), slice(None))
+
+        rows, cols = selection if isinstance(selection, tuple) else (selection, slice(None))
+        cols = np.arange(self.shape[1])[cols]
+        n = len(np.arange(self.shape[0])[rows])
+
+        result = np.empty((n, len(cols)), dtype=self.dtype)
+        for array, offset in zip(self.arrays, self.offsets):
+            selected = (cols >= offset) & (cols < offset + array.shape[1])
+            if selected.any():
+                result[:, selected] = array[rows][:, cols[selected] - offset]
+
+        return result
+
+    def __len__(self):
+        return self.shape[0]
+
+
+class ArrayFile(object):
+    '''
+    A mapping of variable names to arrays (or Columns) with the
+    dictionary-like interface of an HDF5 file: keys() and get().
+    '''
+    def __init__(self, variables):
+        self.variables = dict(variables)
+
+    def get(self, name, default=None):
+        return self.variables.get(name, default)
+
+    def keys(self):
+        return sorted(self.variables.keys())
@@ -0,0 +1,144 @@
+'''
+An on-disk cache of extracted DataFrames, so that extracting the same,
+unchanged file with the same configuration again (e.g. re-running a Suite)
+need not re-read and re-format it; see the "cache_dir" and "cache_size"
+configuration options of a TransformationInterface.
+'''
+
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+try:
+    from hashlib import md5
+
+except ImportError:
+    import md5
+
+class ExtractionCache(object):
+    '''
+    A directory of extracted DataFrames, each stored in a subdirectory named
+    for its key: the values as memory-mappable .npy files (one 2-D array if
+    every column has the same dtype, else one array per column) along with
+    the pickled index and column labels. When the directory grows beyond
+    max_bytes, the least recently used entries are removed.
+    '''
+    max_bytes = 2**30 # 1 GB
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes or self.max_bytes
+
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+
+            except OSError:
+                pass # Created by another process in the meantime
+
+    def __entries__(self):
+        # Returns (last used, size in bytes, path) for each entry
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+
+            size = sum([os.path.getsize(os.path.join(path, f))
+                for f in os.listdir(path)])
+            entries.append((os.path.getmtime(path), size, path))
+
+        return entries
+
+    def evict(self, keep=None):
+        '''
+        Removes the least recently used entries (except for the key to keep)
+        until the cache is no larger than max_bytes
+        '''
+        entries = sorted(self.__entries__())
+        total = sum([size for used, size, path in entries])
+        for used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+
+            if os.path.basename(path) == keep:
+                continue
+
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def get(self, key):
+        '''
+        Returns the DataFrame stored for the key, with its values memory-
+        mapped (copy-on-write), or None if there is no such entry
+        '''
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, 'frame.pkl'), 'rb') as stream:
+                meta = pickle.load(stream)
+
+            if meta['layout'] == 'values':
+                df = pd.DataFrame(np.load(os.path.join(path, 'values.npy'),
+                    mmap_mode='c'), index=meta['index'], columns=meta['columns'])
+
+            else:
+                df = pd.concat([
+                    pd.Series(np.load(os.path.join(path, '%d.npy' % i),
+                        mmap_mode='c'), index=meta['index'], name=col)
+                    for i, col in enumerate(meta['columns'])
+                ], axis=1)
+                df.columns = meta['columns']
+
+        except (IOError, OSError, EOFError):
+            return None
+
+        os.utime(path, None) # Most recently used
+        return df
+
+    def key(self, path, model, config_key):
+        '''
+        Returns the key for a file (which changes with its size and
+        modification time), a model class and the model's configuration
+        '''
+        stat = os.stat(path)
+        return md5(repr((os.path.abspath(path), stat.st_size, stat.st_mtime,
+            model.__module__, model.__name__, config_key))).hexdigest()
+
+    def put(self, key, df):
+        '''
+        Stores a DataFrame for the key, if its values can be memory-mapped
+        (i.e. none are Python objects); returns True if it was stored
+        '''
+        if any([dtype == np.object_ for dtype in df.dtypes]):
+            return False
+
+        # Write to a temporary directory first, so that other processes
+        #   never see an incomplete entry
+        path = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        if len(set(df.dtypes)) == 1:
+            layout = 'values'
+            np.save(os.path.join(path, 'values.npy'), df.values)
+
+        else:
+            layout = 'columns'
+            for i in range(df.shape[1]):
+                np.save(os.path.join(path, '%d.npy' % i), df.iloc[:, i].values)
+
+        with open(os.path.join(path, 'frame.pkl'), 'wb') as stream:
+            pickle.dump({
+                'columns': df.columns,
+                'index': df.index,
+                'layout': layout
+            }, stream, pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.rename(path, os.path.join(self.directory, key))
+
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True) # Stored by another process
+
+        self.evict(keep=key)
+        return True
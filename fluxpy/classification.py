@@ -0,0 +1,238 @@
+'''
+Classification of values for the outputs (e.g. binning values into the
+classes of a color scale): breakpoints, standard scores (z scores) and the
+class of each value, computed on whole arrays. The statistics they are based
+on may be those of a single frame (stats()) or, so that every frame of a time
+series is classified the same way, those in the metadata of the collection
+(collection_stats()).
+
+The breakpoints of a number of classes may be found by any of these schemes
+(see SCHEMES): equal intervals ("equal"), natural breaks ("jenks"),
+quantiles ("quantile") or intervals one standard deviation wide ("stddev").
+Where values are tied (e.g. many zeros), a scheme may find fewer distinct
+breakpoints, and so fewer classes, than were asked for.
+'''
+
+import numpy as np
+import pandas as pd
+
+def breakpoints(mean, std, bins):
+    '''
+    Returns the bins + 1 breakpoints (from -inf to inf) of bins classes of
+    equal width, one standard deviation (std) wide, centered on the mean;
+    with an odd number of bins, the middle class is centered on the mean
+    e.g. for 3 bins, (-inf, mean - 0.5 std, mean + 0.5 std, inf).
+    '''
+    if not isinstance(bins, int):
+        raise TypeError('Integer bins argument expected')
+
+    # The distance (in tenths of a standard deviation) of each breakpoint
+    #   from the mean
+    offsets = np.arange(1, bins) * 10 - (bins * 5)
+    return np.concatenate(([-np.inf], (offsets * 0.1 * std) + mean, [np.inf]))
+
+
+def _distinct(breaks):
+    # The breakpoints, from -inf to inf, without any duplicates (of tied
+    #   values), so that every class is distinct
+    return np.concatenate(([-np.inf], np.unique(breaks), [np.inf]))
+
+
+def _finite(values):
+    # The finite values, their minimum and their maximum
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        raise ValueError('Cannot classify without any (finite) values')
+
+    return (values, values.min(), values.max())
+
+
+def classify(values, breakpoints):
+    '''
+    Returns the index of the class of each value, where class i includes
+    the values in the interval (breakpoints[i], breakpoints[i + 1]] (as
+    with pandas.cut()), or -1 for no value (NaN); breakpoints[0] and
+    breakpoints[-1] should be -inf and inf.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+
+    # As np.digitize(..., right=True) would (NumPy >= 1.10 only)
+    classes = np.searchsorted(np.asarray(breakpoints)[1:-1], values, side='left')
+    classes[np.isnan(values)] = -1
+    return classes
+
+
+def collection_stats(mediator, collection_name, keys):
+    '''
+    Returns the (mean, standard deviation) of each of the fields given by
+    the keys, as a dictionary, from the summary statistics in the metadata of
+    the collection; these are calculated when the metadata entry is created
+    (see Mediator.generate_metadata()).
+    '''
+    query = mediator.client[mediator.db_name]['metadata'].find({
+        '_id': collection_name
+    })
+
+    summary = query.next().get('stats', {}) if query.count() > 0 else {}
+    for key in keys:
+        if summary.get(key) is None:
+            raise ValueError('No summary statistics for "%s" in the metadata of the "%s" collection' % (key, collection_name))
+
+    return dict([(key, (summary[key]['mean'], summary[key]['std']))
+        for key in keys])
+
+
+def equal_intervals(values, bins):
+    '''
+    Returns the bins + 1 breakpoints (from -inf to inf) of bins classes of
+    equal width between the minimum and maximum of the values; if they are
+    all the same, there is a single breakpoint (two classes)
+    '''
+    values, lo, hi = _finite(values)
+    return _distinct(lo + (hi - lo) * np.arange(1, bins) / float(bins))
+
+
+def natural_breaks(values, bins, resolution=1000):
+    '''
+    Returns the bins + 1 breakpoints (from -inf to inf) of bins classes of
+    the values, found by the Jenks (Fisher) natural breaks method, which
+    minimizes the sum of squared deviations from the class means. Rather
+    than each value, the method classifies the values in each of (at most)
+    resolution intervals of equal width between the minimum and maximum,
+    so it takes the same time for any number of values; each breakpoint is
+    the greatest value in its class. With fewer (non-empty) intervals than
+    bins, there is a class for each interval.
+    '''
+    values, lo, hi = _finite(values)
+    if lo == hi:
+        return _distinct([lo])
+
+    # Count, sum and sum the squares of (the deviations from the mean of)
+    #   the values in each (non-empty) interval
+    index = np.minimum(((values - lo) / (hi - lo) * resolution).astype(np.intp),
+        resolution - 1)
+    deviations = values - values.mean()
+    counts = np.bincount(index, minlength=resolution)
+    used = np.flatnonzero(counts)
+    counts = counts[used]
+
+    # The greatest value in each interval, from the values sorted by interval
+    #   (np.maximum.at() would need NumPy >= 1.8)
+    greatest = np.maximum.reduceat(values[np.argsort(index)],
+        np.concatenate(([0], np.cumsum(counts)[:-1])))
+
+    sums = np.bincount(index, deviations, minlength=resolution)[used]
+    squares = np.bincount(index, deviations ** 2, minlength=resolution)[used]
+
+    # The sum of squared deviations of a class of the intervals from s to i
+    #   (inclusive) is ssd[s, i]
+    n = len(used)
+    c, s, q = [np.concatenate(([0], np.cumsum(a))) for a in (counts, sums, squares)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssd = ((q[None, 1:] - q[:-1, None]) -
+            (s[None, 1:] - s[:-1, None]) ** 2 / (c[None, 1:] - c[:-1, None]))
+
+    ssd[np.tril_indices(n, -1)] = np.inf # Classes must not be empty
+
+    # The least sum for the intervals up to i in j + 1 classes is cost[i];
+    #   the last class (of those) starts at starts[j][i]
+    k = min(bins, n)
+    cost = ssd[0]
+    starts = []
+    for j in range(1, k):
+        total = cost[:-1, None] + ssd[1:]
+        starts.append(total.argmin(axis=0) + 1)
+        cost = total.min(axis=0)
+
+    # The breakpoints are the greatest values in all but the last class
+    breaks = []
+    i = n - 1
+    for j in reversed(range(1, k)):
+        i = starts[j - 1][i] - 1
+        breaks.insert(0, greatest[i])
+
+    return _distinct(breaks)
+
+
+def parse_bins(bins):
+    '''
+    Returns the (scheme, number of classes) given by the bins argument of an
+    output: an integer number of standard deviation classes or a (scheme,
+    number) pair e.g. ('jenks', 5); see SCHEMES.
+    '''
+    if isinstance(bins, int):
+        return ('stddev', bins)
+
+    try:
+        scheme, number = bins
+
+    except (TypeError, ValueError):
+        raise TypeError('Integer bins argument or a (scheme, bins) pair expected')
+
+    if scheme not in SCHEMES:
+        raise ValueError('Unknown classification scheme "%s"; expected one of: %s' % (scheme, ', '.join(sorted(SCHEMES.keys()))))
+
+    if not isinstance(number, int):
+        raise TypeError('Integer number of bins expected')
+
+    return (scheme, number)
+
+
+def precision(breakpoints, decimals=1, max_decimals=6):
+    '''
+    Returns the least number of decimals (at least decimals, at most
+    max_decimals) with which the distinct (finite) breakpoints are formatted
+    differently e.g. for the labels of a legend
+    '''
+    finite = set([b for b in breakpoints if np.isfinite(b)])
+    for d in range(decimals, max_decimals):
+        if len(set(['%.*f' % (d, b) for b in finite])) == len(finite):
+            return d
+
+    return max_decimals
+
+
+def quantiles(values, bins):
+    '''
+    Returns the bins + 1 breakpoints (from -inf to inf) of bins classes
+    with (about) the same number of values in each; where a value is tied
+    across quantiles (e.g. most of the values are zero), the classes that
+    would be the same are merged, so there are fewer of them
+    '''
+    values, lo, hi = _finite(values)
+    return _distinct(np.percentile(values, np.linspace(0, 100, bins + 1)[1:-1]))
+
+
+def scores(values, mean, std):
+    '''Returns the standard scores (z scores) of the values'''
+    return (np.asarray(values, dtype=np.float64) - mean) * (1 / std)
+
+
+def stats(values):
+    '''
+    Returns the (mean, standard deviation) of the values, skipping NaNs, as
+    the summary statistics of a collection are calculated
+    '''
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    return (series.mean(), series.std())
+
+
+def std_intervals(values, bins):
+    '''
+    Returns the bins + 1 breakpoints (from -inf to inf) of bins classes one
+    standard deviation wide, centered on the mean of the values; see
+    breakpoints()
+    '''
+    mean, std = stats(values)
+    return breakpoints(mean, std, bins)
+
+
+# The classification schemes, each a function of the values and the number
+#   of classes (bins) that returns the bins + 1 breakpoints
+SCHEMES = {
+    'equal': equal_intervals,
+    'jenks': natural_breaks,
+    'quantile': quantiles,
+    'stddev': std_intervals
+}
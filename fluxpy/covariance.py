@@ -0,0 +1,202 @@
+'''
+Compact representations of (symmetric) covariance matrices, of which only
+the upper triangle is stored, and products with them that are computed one
+block of rows at a time, without creating the dense matrix.
+
+A "block source" is any object with an iter_blocks(chunk_rows) method that
+generates (first row, block of rows) pairs for a square, symmetric matrix,
+e.g. a CovarianceMatrix (read from a file) or a PackedCovariance.
+'''
+
+import numpy as np
+import scipy.sparse
+
+def block_dot(n, blocks, other):
+    '''
+    Returns the product of an n-by-n matrix, given as a sequence of (first
+    row, block of rows) pairs, and a vector or matrix (other)
+    '''
+    other = np.asarray(other)
+    result = np.empty((n,) + other.shape[1:])
+    for start, block in blocks:
+        result[start:(start + block.shape[0])] = block.dot(other)
+
+    return result
+
+
+def quadratic_forms(blocks, weights):
+    '''
+    Returns w'Cw for each column w of an n-by-k matrix of weights (dense or
+    sparse) e.g. the variance of a weighted sum over each of k regions,
+    where C is an n-by-n (covariance) matrix given as a sequence of (first
+    row, block of rows) pairs. The blocks are read in a single pass, so
+    that at most one block of rows and its product with the weights are in
+    memory at a time.
+    '''
+    if not scipy.sparse.issparse(weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim == 1:
+            weights = weights.reshape((-1, 1))
+
+    else:
+        weights = weights.tocsr()
+
+    result = np.zeros(weights.shape[1])
+    for start, block in blocks:
+        rows = weights[start:(start + block.shape[0])]
+        if scipy.sparse.issparse(weights):
+            # The rows (cells) of a block outside every region contribute nothing
+            if rows.nnz == 0:
+                continue
+
+            product = weights.T.dot(block.T).T # The block's rows of CW
+            result += np.asarray(rows.multiply(product).sum(0)).ravel()
+
+        else:
+            result += (rows * block.dot(weights)).sum(0)
+
+    return result
+
+
+def region_weights(regions, n, mean=False, scale=None):
+    '''
+    Creates the sparse n-by-k matrix of weights for k regions, given a
+    mapping of each region's name to the indices of its cells (rows of the
+    covariance matrix), e.g. from get_state_cells() in scripts/flux_by_state;
+    returns a tuple of the (sorted) region names and the weights. Each cell
+    has a weight of 1 (a sum over the region) or, if mean is True, one over
+    the number of cells (a mean over the region); the weights of a region are
+    multiplied by scale[name], if a scale is given (e.g. one over the area).
+    '''
+    names = sorted(regions.keys())
+    rows, cols, data = [], [], []
+    for k, name in enumerate(names):
+        cells = list(regions[name])
+        weight = (1.0 / len(cells)) if (mean and len(cells) > 0) else 1.0
+        if scale is not None:
+            weight *= scale[name]
+
+        rows.extend(cells)
+        cols.extend([k] * len(cells))
+        data.extend([weight] * len(cells))
+
+    return (names, scipy.sparse.csc_matrix((data, (rows, cols)),
+        shape=(n, len(names))))
+
+
+def packed_offsets(n):
+    '''
+    Returns the offset, in the packed upper triangle of an n-by-n matrix,
+    of the first (diagonal) entry of each row, followed by the number of
+    packed entries, n(n+1)/2; row i has n - i entries.
+    '''
+    i = np.arange(n + 1, dtype=np.int64)
+    return i * n - (i * (i - 1)) // 2
+
+
+class PackedCovariance(object):
+    '''
+    A symmetric n-by-n matrix of which only the upper triangle (including
+    the diagonal) is stored: either packed, row by row, into a 1-D array
+    (values) or, if the matrix was sparsified, as a sparse matrix (upper)
+    without the off-diagonal entries that are no greater than a tolerance,
+    in absolute value. Rows, blocks of rows and products with the matrix are
+    computed from the upper triangle alone.
+    '''
+    def __init__(self, n, values=None, upper=None, tolerance=None):
+        assert (values is None) != (upper is None), 'Expected either packed values or a sparse upper triangle'
+        self.n = n
+        self.tolerance = tolerance
+        self.upper = None
+        self.values = values
+
+        if values is not None:
+            self.offsets = packed_offsets(n)
+            assert len(values) == self.offsets[-1], 'Expected n(n+1)/2 packed values'
+
+        else:
+            self.upper = scipy.sparse.csr_matrix(upper)
+            self.lower = self.upper.T.tocsr() # Rows of the lower triangle
+            self.diagonal = self.upper.diagonal()
+
+    @classmethod
+    def from_blocks(cls, n, blocks, tolerance=None):
+        '''
+        Creates a packed matrix from a sequence of (first row, block of rows)
+        pairs, e.g. from CovarianceMatrix.iter_blocks(), so that at most one
+        dense block of rows is in memory at a time. If a tolerance is given,
+        the off-diagonal entries no greater than the tolerance (in absolute
+        value) are dropped and the matrix is stored as a sparse matrix.
+        '''
+        if tolerance is None:
+            offsets = packed_offsets(n)
+            values = np.empty(offsets[-1])
+            for start, block in blocks:
+                for k, row in enumerate(block):
+                    values[offsets[start + k]:offsets[start + k + 1]] = row[(start + k):]
+
+            return cls(n, values=values)
+
+        rows, cols, data = [], [], []
+        for start, block in blocks:
+            # Keep the diagonal and the upper triangle above the tolerance
+            keep = np.triu(np.abs(block) > tolerance, start)
+            k = np.arange(block.shape[0])
+            keep[k, k + start] = True
+
+            i, j = np.nonzero(keep)
+            rows.append(i + start)
+            cols.append(j)
+            data.append(block[i, j])
+
+        upper = scipy.sparse.coo_matrix((np.concatenate(data),
+            (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+
+        return cls(n, upper=upper, tolerance=tolerance)
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    def block(self, start, stop):
+        '''Returns the rows from start up to (not including) stop, as dense rows'''
+        stop = min(stop, self.n)
+        if self.upper is not None:
+            result = (self.upper[start:stop] + self.lower[start:stop]).toarray()
+            k = np.arange(stop - start)
+            result[k, k + start] -= self.diagonal[start:stop] # Counted twice
+            return result
+
+        result = np.empty((stop - start, self.n))
+        for k, i in enumerate(range(start, stop)):
+            # Entries left of the diagonal are read down column i
+            j = np.arange(i)
+            result[k, :i] = self.values[self.offsets[j] + i - j]
+            result[k, i:] = self.values[self.offsets[i]:self.offsets[i + 1]]
+
+        return result
+
+    def dot(self, other, chunk_rows=1000):
+        '''
+        Returns the product of this matrix and a vector or matrix (other),
+        computed one block of rows at a time
+        '''
+        other = np.asarray(other)
+        if self.upper is not None:
+            diagonal = self.diagonal.reshape((-1,) + (1,) * (other.ndim - 1))
+            return self.upper.dot(other) + self.lower.dot(other) - diagonal * other
+
+        return block_dot(self.n, self.iter_blocks(chunk_rows), other)
+
+    def iter_blocks(self, chunk_rows=1000):
+        '''Generates (first row, block of rows) pairs of (at most) chunk_rows rows'''
+        for start in range(0, self.n, chunk_rows):
+            yield (start, self.block(start, start + chunk_rows))
+
+    def row(self, i):
+        '''Returns row (and column) i'''
+        return self.block(i, i + 1)[0]
+
+    def toarray(self):
+        '''Returns the dense matrix'''
+        return self.block(0, self.n)
@@ -0,0 +1,176 @@
+'''
+A persistent inventory of the data files in a directory, so that files can
+be selected by time range (e.g. "the XCO2 files for June 2009") without
+opening every one of them each time.
+'''
+
+import datetime
+import json
+import os
+from dateutil import parser
+from fluxpy.models import stable_repr
+
+try:
+    from hashlib import md5
+
+except ImportError:
+    import md5
+
+class Inventory(object):
+    '''
+    An inventory of the data files in a directory, stored as JSON in that
+    directory (filename). For each file, it records the size and
+    modification time, the model (and configuration) that read it, the
+    first date (timestamp), the dates, steps or spans, the time range it
+    covers (start, end), the shape, dtype and name of the variable and the
+    names of all the variables in the file. A file is only opened (with the
+    model's inspect() method) when it is new or has changed since it was
+    recorded.
+    '''
+    filename = '.fluxpy_inventory.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = dict()
+        self.path = os.path.join(directory, self.filename)
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as stream:
+                    self.entries = json.load(stream)
+
+            except ValueError:
+                pass # A corrupt inventory is rebuilt
+
+    def __entry__(self, path, model, config, **kwargs):
+        # Creates the entry for a file, opening it with the model
+        stat = os.stat(path)
+        entry = {
+            'config': config,
+            'model': model.__name__,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size
+        }
+
+        try:
+            info = model(path, **kwargs).inspect()
+
+        except Exception, e:
+            entry['error'] = str(e) or e.__class__.__name__
+            return entry
+
+        dates = sorted([parser.parse(d) for d in info['dates']])
+        end = dates[-1]
+        if info.get('spans'):
+            end = end + datetime.timedelta(seconds=max(info['spans']))
+
+        entry.update({
+            'dates': info['dates'],
+            'dtype': info.get('dtype'),
+            'end': end.strftime('%Y-%m-%dT%H:%M:%S'),
+            'shape': list(info['shape']),
+            'spans': info.get('spans'),
+            'start': dates[0].strftime('%Y-%m-%dT%H:%M:%S'),
+            'steps': info.get('steps'),
+            'timestamp': dates[0].strftime('%Y-%m-%dT%H:%M:%S'),
+            'var_name': info['var_name'],
+            'variables': info['variables']
+        })
+
+        return entry
+
+    def refresh(self, model, paths=None, **kwargs):
+        '''
+        Updates the inventory for the given file paths in the directory (by
+        default, every Matlab and HDF5 file in it), opening only those files
+        that are new or have changed, or were read by another model or with
+        another configuration (given as keyword arguments to the model);
+        entries for files that no longer exist are removed.
+        '''
+        if paths is None:
+            paths = [os.path.join(self.directory, f)
+                for f in os.listdir(self.directory)
+                if os.path.splitext(f)[1] in ('.mat', '.h5')]
+
+        # The same fingerprint in every process, even for e.g. a transform
+        config = md5(stable_repr(sorted(kwargs.items()))).hexdigest()
+        changed = False
+        for path in paths:
+            name = os.path.basename(path)
+            if not os.path.exists(path):
+                continue
+
+            stat = os.stat(path)
+            entry = self.entries.get(name, {})
+            if (entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime
+                    and entry.get('model') == model.__name__ and entry.get('config') == config):
+                continue
+
+            self.entries[name] = self.__entry__(path, model, config, **kwargs)
+            changed = True
+
+        for name in self.entries.keys():
+            if not os.path.exists(os.path.join(self.directory, name)):
+                del self.entries[name]
+                changed = True
+
+        if changed:
+            self.save()
+
+        return self
+
+    def save(self):
+        '''Writes the inventory to the directory, if it can be written to'''
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as stream:
+                json.dump(self.entries, stream, indent=2, sort_keys=True)
+
+            os.rename(tmp, self.path)
+
+        except (IOError, OSError):
+            pass # e.g. a read-only data directory; the inventory still works
+
+    def select(self, start=None, end=None, paths=None):
+        '''
+        Returns the sorted paths of the files (optionally, only those among
+        the given paths) with data in the time range from start to end (ISO
+        8601 strings or datetime instances; either may be omitted); files
+        that could not be read are never selected.
+        '''
+        start = parser.parse(start) if isinstance(start, basestring) else start
+        end = parser.parse(end) if isinstance(end, basestring) else end
+        names = None if paths is None else set(map(os.path.basename, paths))
+
+        selected = []
+        for name, entry in self.entries.items():
+            if entry.has_key('error') or (names is not None and name not in names):
+                continue
+
+            if start is not None and parser.parse(entry['end']) < start:
+                continue
+
+            if end is not None and parser.parse(entry['start']) > end:
+                continue
+
+            selected.append(os.path.join(self.directory, name))
+
+        return sorted(selected)
+
+
+def select_paths(paths, model, start=None, end=None, **kwargs):
+    '''
+    Returns those of the file paths with data in the time range from start
+    to end, refreshing the inventory of each directory the files are in;
+    additional keyword arguments are passed to the model.
+    '''
+    directories = dict()
+    for path in paths:
+        directories.setdefault(os.path.dirname(path) or '.', []).append(path)
+
+    selected = []
+    for directory, members in directories.items():
+        inventory = Inventory(directory).refresh(model, members, **kwargs)
+        selected.extend(inventory.select(start, end, members))
+
+    return sorted(selected)
@@ -0,0 +1,221 @@
+'''
+Selective reading of Matlab (*.mat) files. Only the header of each variable
+is read when a file is opened; a variable's data are read when (and only
+when) that variable is asked for. Uncompressed numeric arrays are
+memory-mapped rather than read into memory. Matlab v7.3 files are HDF5 files
+and should be opened with h5py instead (see is_hdf5()).
+
+The layout of the file is described in "MATLAB 5.0 MAT-file Format"
+(The MathWorks, 1999).
+'''
+
+import struct
+import zlib
+import numpy as np
+import scipy.io
+
+HDF5_SIGNATURE = '\x89HDF\r\n\x1a\n'
+HEADER_BYTES = 128
+
+# Data types
+MI_UINT32 = 6
+MI_INT32 = 5
+MI_INT8 = 1
+MI_MATRIX = 14
+MI_COMPRESSED = 15
+MI_DTYPES = {
+    1: 'i1',
+    2: 'u1',
+    3: 'i2',
+    4: 'u2',
+    5: 'i4',
+    6: 'u4',
+    7: 'f4',
+    9: 'f8',
+    12: 'i8',
+    13: 'u8'
+}
+
+# Array classes that are numeric arrays (i.e. not cells, structures, objects,
+#   character arrays or sparse arrays)
+MX_NUMERIC = range(6, 16)
+
+# Array flags
+MF_COMPLEX = 0x0800
+MF_LOGICAL = 0x0200
+
+def read_header(path):
+    '''
+    Returns the (major) version number and the byte order of a Matlab file,
+    read from its 128-byte header; the version is 1 for a v5 (or v6, v7)
+    file, 2 for a v7.3 (HDF5) file and 0 for a v4 file.
+    '''
+    with open(path, 'rb') as stream:
+        header = stream.read(HEADER_BYTES)
+
+    if header.startswith(HDF5_SIGNATURE):
+        return (2, None)
+
+    if len(header) < HEADER_BYTES or header[126:128] not in ('IM', 'MI'):
+        return (0, None) # Level 4 files have no text header
+
+    byte_order = '<' if header[126:128] == 'IM' else '>'
+    version = struct.unpack(byte_order + 'H', header[124:126])[0] >> 8
+
+    return (version, byte_order)
+
+
+def is_hdf5(path):
+    '''True if the file is an HDF5 file e.g. a Matlab v7.3 file'''
+    return read_header(path)[0] == 2
+
+
+class Inflater(object):
+    '''
+    A file-like reader of the decompressed bytes of a compressed data
+    element, which decompresses only as many bytes as are read.
+    '''
+    chunk_size = 4096
+
+    def __init__(self, stream, nbytes):
+        self.buffer = ''
+        self.decompressor = zlib.decompressobj()
+        self.remaining = nbytes
+        self.stream = stream
+
+    def read(self, n):
+        while len(self.buffer) < n and self.remaining > 0:
+            chunk = self.stream.read(min(self.chunk_size, self.remaining))
+            if not chunk:
+                break
+
+            self.remaining -= len(chunk)
+            self.buffer += self.decompressor.decompress(chunk)
+
+        result, self.buffer = self.buffer[:n], self.buffer[n:]
+        return result
+
+
+class MatFile(object):
+    '''
+    A Matlab v4 or v5 (v6, v7) file, with the dictionary-like interface of
+    an HDF5 file: keys() are the variable names and get() returns a
+    variable's data (memory-mapped, if it is an uncompressed numeric array).
+    '''
+    def __init__(self, path, mmap=True):
+        self.mmap = mmap
+        self.path = path
+        self.variables = {}
+        self.version, self.byte_order = read_header(path)
+
+        if self.version == 2:
+            raise NotImplementedError('Matlab v7.3 (HDF5) files should be opened with h5py')
+
+        if self.version == 1:
+            self.headers = self.__scan__()
+
+        else:
+            self.headers = [
+                (name, None) for name, shape, cls in scipy.io.whosmat(path)
+            ]
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __element__(self, read, data=True):
+        # Reads the tag and (optionally) the data of a data element
+        tag = read(8)
+        dtype, nbytes = struct.unpack(self.byte_order + 'II', tag)
+        if dtype >> 16:
+            # Small data element format: the data are packed into the tag
+            return (dtype & 0xffff, dtype >> 16, tag[4:4 + (dtype >> 16)])
+
+        if not data:
+            return (dtype, nbytes, None)
+
+        # Data elements are padded to 64-bit boundaries
+        return (dtype, nbytes, read(nbytes + (-nbytes % 8))[:nbytes])
+
+    def __scan__(self):
+        # Reads the header of each variable (array), skipping over its data;
+        #   returns a sequence of (name, memory map parameters) pairs
+        headers = []
+        with open(self.path, 'rb') as stream:
+            stream.seek(HEADER_BYTES)
+            while True:
+                tag = stream.read(8)
+                if len(tag) < 8:
+                    break
+
+                dtype, nbytes = struct.unpack(self.byte_order + 'II', tag)
+                start = stream.tell()
+                if dtype == MI_COMPRESSED:
+                    inflater = Inflater(stream, nbytes)
+                    if self.__element__(inflater.read, data=False)[0] == MI_MATRIX:
+                        headers.append((self.__variable__(inflater.read)[0], None))
+
+                elif dtype == MI_MATRIX:
+                    headers.append(self.__variable__(stream.read, stream.tell))
+
+                stream.seek(start + nbytes)
+
+        return headers
+
+    def __variable__(self, read, tell=None):
+        # Reads the header of an array; if the position in the file is known,
+        #   also reads the tag of the real part, which determines whether or
+        #   not the array can be memory-mapped
+        flags = np.frombuffer(self.__element__(read)[2], self.byte_order + 'u4')
+        shape = np.frombuffer(self.__element__(read)[2], self.byte_order + 'i4')
+        name = self.__element__(read)[2]
+
+        if tell is None or (flags[0] & 0xff) not in MX_NUMERIC:
+            return (name, None)
+
+        if flags[0] & (MF_COMPLEX | MF_LOGICAL):
+            return (name, None)
+
+        dtype, nbytes, data = self.__element__(read, data=False)
+        if data is not None or dtype not in MI_DTYPES:
+            return (name, None)
+
+        dtype = np.dtype(self.byte_order + MI_DTYPES[dtype])
+        if nbytes == 0 or nbytes != dtype.itemsize * np.prod(shape):
+            return (name, None)
+
+        return (name, (dtype, tell(), tuple(shape)))
+
+    def close(self):
+        self.variables = {}
+
+    def get(self, name, default=None):
+        '''
+        Returns the data of the named variable (or default, if there is no
+        such variable); uncompressed numeric arrays are memory-mapped and
+        other variables are read, without reading any other variable. Arrays
+        in a file of the other byte order are read into memory instead.
+        '''
+        if name not in self.variables:
+            if name not in self.keys():
+                return default
+
+            params = dict(self.headers)[name]
+            if params is not None and self.mmap:
+                dtype, offset, shape = params
+                self.variables[name] = np.memmap(self.path, dtype=dtype,
+                    mode='r', offset=offset, shape=shape, order='F')
+
+                # Arrays in a big-endian file are converted (and so read) to
+                #   the native byte order, which pandas requires
+                if not dtype.isnative:
+                    self.variables[name] = self.variables[name].astype(
+                        dtype.newbyteorder('='))
+
+            else:
+                self.variables[name] = scipy.io.loadmat(self.path,
+                    variable_names=[name]).get(name)
+
+        return self.variables[name]
+
+    def keys(self):
+        return [name for name, params in self.headers]
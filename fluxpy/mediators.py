@@ -10,11 +10,14 @@
 #===============================================================================
 
 import datetime
+import itertools
 import os
 import re
 import sys
 import pandas as pd
 import numpy as np
+from contextlib import contextmanager
+from bson.binary import Binary
 from dateutil import parser
 from pymongo import MongoClient
 from fluxpy import DB, DEFAULT_PATH, ISO_8601, RESERVED_COLLECTION_NAMES
@@ -30,16 +33,29 @@ class Mediator(object):
     A generic model for transforming data between foreign formats and the
     persistence layer of choice (MongoDB in this application). Mediator calls
     the extract() method on subclasses of the TransformationInterface (those
-    classes that interpret foreign formats).
+    classes that interpret foreign formats). Subclasses define the encode()
+    method and extend the save() method.
     '''
+    chunk_option = None # The encode() option, if any, that bounds its memory use
+    parallel = True # Whether encode() may be run in a worker process; see bulk_save()
+    document_bytes = 32 # Approx. memory used by each value as a document (list of floats)
+    frame_bytes = 24 # Approx. memory used by each value as DataFrame(s) (float64)
 
     def __init__(self, client=None, db_name=DB):
-        self.client = client or MongoClient() # The MongoDB client; defaults: MongoClient('localhost', 27017)
+        self.__client__ = client # The MongoDB client; see the client property
         self.db_name = db_name # The name of the MongoDB database
 
-    def __get_updates__(self, query, metadata):
-        # Updates the metadata in the passed MongoDB query
-        last_metadata = query.next()
+    @property
+    def client(self):
+        # Connect on first use so that a Mediator can be created in a worker
+        #   process (e.g. to encode data) without a database connection
+        if self.__client__ is None:
+            self.__client__ = MongoClient() # Defaults: MongoClient('localhost', 27017)
+
+        return self.__client__
+
+    def __get_updates__(self, last_metadata, metadata):
+        # Updates the metadata of the last metadata document
         update_selection = {}
 
         if last_metadata.has_key('dates'):
@@ -117,6 +133,80 @@ class Mediator(object):
 
         return update_selection
 
+    def __merge_metadata__(self, batch, metadata, force=False):
+        # Merges the metadata from one save into the pending metadata of a
+        #   batch, just as generate_metadata() would merge them in the database;
+        #   if forced, they replace the pending metadata, as they would
+        #   replace the entry
+        if batch['metadata'] is not None and not force:
+            batch['metadata'].update(self.__get_updates__(batch['metadata'],
+                metadata))
+            return
+
+        collection_name = batch['collection_name']
+        query = self.client[self.db_name]['metadata'].find({
+            '_id': collection_name
+        })
+
+        # The summary statistics are only calculated when the entry is created
+        if force or query.count() == 0:
+            batch['created'] = True
+            batch['metadata'] = dict(metadata)
+            batch['metadata']['_id'] = collection_name
+            batch['metadata']['stats'] = self.summarize(collection_name)
+
+        else:
+            batch['created'] = False
+            batch['metadata'] = query.next()
+            batch['metadata'].update(self.__get_updates__(batch['metadata'],
+                metadata))
+
+    @contextmanager
+    def batch(self, collection_name, verbose=False):
+        '''
+        Returns a context manager that defers the metadata for a collection
+        until a batch of saves is finished e.g.:
+
+            with mediator.batch('xco2'):
+                for path in paths:
+                    mediator.save('xco2', KrigedXCO2Matrix(path))
+
+        The dates and steps (or spans) of each save are merged in memory and
+        the metadata entry is written once, on exit, with the same content as
+        if it had been updated after each save; metadata generated with force
+        replace those of any earlier saves in the batch.
+        '''
+        self.__batch__ = {
+            'collection_name': collection_name,
+            'created': False,
+            'metadata': None
+        }
+
+        try:
+            yield self
+
+        finally:
+            batch, self.__batch__ = self.__batch__, None
+
+            # Anything inserted before an error still needs its metadata
+            if batch['metadata'] is not None:
+                if verbose: sys.stderr.write('\nWriting metadata...')
+
+                if batch['created']:
+                    self.client[self.db_name]['metadata'].remove({
+                        '_id': collection_name
+                    })
+                    self.client[self.db_name]['metadata'].insert(batch['metadata'])
+
+                else:
+                    self.client[self.db_name]['metadata'].update({
+                        '_id': collection_name
+                    }, {
+                        '$set': dict([(k, batch['metadata'][k])
+                            for k in ('dates', 'steps', 'spans')
+                            if batch['metadata'].has_key(k)])
+                    })
+
     def copy_grid_geometry(self, reference_name):
         coords = self.client[self.db_name]['coord_index'].find({
             '_id': reference_name
@@ -127,16 +217,56 @@ class Mediator(object):
             'i': coords
         })
 
-    def generate_metadata(self, collection_name, instance, force=False, verbose=False):
+    def describe(self, instance, coords, **kwargs):
+        '''
+        Returns the metadata for an instance that was encoded, with the given
+        options (keyword arguments) to encode(), as the given coordinates:
+        by default, those from the instance's describe() method. Does not
+        touch the database, so it can be called in a worker process.
+        '''
+        return dict(instance.describe())
+
+    def encode(self, instance):
+        '''
+        Transforms the contents of a TransformationInterface instance into
+        MongoDB documents; returns a tuple of the coordinates (for the
+        coord_index collection) and a sequence of documents. Does not touch
+        the database, so it can be called in a worker process. Defined in
+        subclasses.
+        '''
+        pass
+
+    def estimate(self, shape, itemsize=8, materialize=False, **kwargs):
+        '''
+        Estimates the peak memory (in bytes) needed to extract and encode a
+        variable of the given shape and item size (bytes per value): the
+        values as read, as a DataFrame and as documents. If materialize is
+        True, every document is in memory at once, as when a worker process
+        returns them (see fluxpy.utils.bulk_save()); additional keyword
+        arguments are the options to encode().
+        '''
+        return int(np.prod(shape)) * (itemsize + self.frame_bytes + self.document_bytes)
+
+    def generate_metadata(self, collection_name, instance, force=False,
+            verbose=False, metadata=None):
         '''
         Creates an entry in the metadata collection for this instance of data;
         updates the summary statistics of that entry if it already exists.
+        Metadata that were already generated by the instance's describe()
+        method (e.g. in another process) may be provided instead. Within a
+        batch() for the same collection, the metadata are only merged in
+        memory.
         '''
 
         if verbose: sys.stderr.write('\nGenerating metadata...')
 
-        # Get the metadata
-        metadata = instance.describe()
+        # Get the metadata; a copy, as describe() returns its memoized result
+        metadata = dict(instance.describe() if metadata is None else metadata)
+
+        batch = getattr(self, '__batch__', None)
+        if batch is not None and batch['collection_name'] == collection_name:
+            self.__merge_metadata__(batch, metadata, force)
+            return metadata
 
         # Set the unique identifier; include the summary statistics
         metadata['_id'] = collection_name
@@ -155,7 +285,7 @@ class Mediator(object):
             self.client[self.db_name]['metadata'].insert(metadata)
 
         else:
-            update_selection = self.__get_updates__(query, metadata)
+            update_selection = self.__get_updates__(query.next(), metadata)
 
             # If anything's changed, update the database!
             if len(update_selection.items()) != 0:
@@ -215,6 +345,29 @@ class Mediator(object):
 
         return summary
 
+    def write(self, collection_name, coords, documents, verbose=False):
+        '''
+        Inserts the documents produced by encode() into a collection; creates
+        the index of coordinates for the collection, if needed.
+        '''
+        if self.client[self.db_name]['coord_index'].find({
+            '_id': collection_name
+        }).count() == 0:
+            self.client[self.db_name]['coord_index'].insert({
+                '_id': collection_name,
+                'i': coords
+            })
+
+        if verbose: sys.stderr.write('\nInserting records...')
+
+        # The documents may be generated as they are inserted
+        total_records = len(documents) if hasattr(documents, '__len__') else '?'
+        for i, document in enumerate(documents):
+            self.client[self.db_name][collection_name].insert(document)
+
+            if verbose: sys.stderr.write('\rInserted %d of %s records...'
+                                 % (i+1, total_records))
+
 
 class Grid4DMediator(Mediator):
     '''
@@ -223,6 +376,7 @@ class Grid4DMediator(Mediator):
     time steps (frames). Geometry expected as grid centroids (e.g. centroids
     of 1-degree grid cells).
     '''
+    chunk_option = 'chunk_steps'
 
     def load(self, collection_name, query):
         # Retrieve a cursor to iterate over the records matching the query
@@ -256,51 +410,77 @@ class Grid4DMediator(Mediator):
 
         return dfm
 
-    def save(self, collection_name, instance, verbose=False):
-        super(Grid4DMediator, self).save(collection_name, instance)
+    def __documents__(self, frames, precision=None):
+        # Generates one document for each time step (column) of each frame
+        for df in frames:
+            for timestamp, series in df.iteritems():
+                if precision is not None:
+                    yield {
+                        '_id': timestamp,
+                        'values': [round(x, precision) for x in series.tolist()]
+                    }
+
+                else:
+                    yield {
+                        '_id': timestamp,
+                        'values': series.tolist()
+                    }
+
+    def encode(self, instance, chunk_steps=None):
+        '''
+        Encodes each time step as a document. If chunk_steps is given and the
+        instance supports iter_extract(), the data are read and the documents
+        generated (as they are inserted) a block of time steps at a time.
+        '''
+        if chunk_steps is not None and hasattr(instance, 'iter_extract'):
+            frames = instance.iter_extract(chunk_steps)
 
-        df = instance.extract()
+        else:
+            frames = iter([instance.extract()])
 
-        # Create the index of grid cell coordinates, if needed
-        if self.client[self.db_name]['coord_index'].find({
-            '_id': collection_name
-        }).count() == 0:
-            self.client[self.db_name]['coord_index'].insert({
-                '_id': collection_name,
-                'i': list(df.index.values)
-            })
+        # The first frame has the grid cell coordinates shared by every frame
+        first = next(frames)
+        documents = self.__documents__(itertools.chain([first], frames),
+            getattr(instance, 'precision', None))
 
-        # Iterate over the transpose of the data frame
-        total_records = len(df.T)
-        for i, (timestamp, series) in enumerate(df.T.iterrows()):
-            if getattr(instance, 'precision', None) is not None:
-                self.client[self.db_name][collection_name].insert({
-                    '_id': timestamp,
-                    'values': map(lambda x: round(x[1], instance.precision),
-                        series.iterkv())
-                })
+        return (list(first.index.values), documents)
 
-            else:
-                self.client[self.db_name][collection_name].insert({
-                    '_id': timestamp,
-                    'values': series.tolist()
-                })
+    def estimate(self, shape, itemsize=8, materialize=False, chunk_steps=None):
+        # Only a block of chunk_steps time steps (columns) is read at a time
+        #   and the documents, one per time step, are inserted as they are
+        #   generated, unless they are materialized
+        rows, steps = shape
+        chunk = min(chunk_steps or steps, steps)
+        documents = rows * (steps if materialize else 1) * self.document_bytes
+        return rows * chunk * (itemsize + self.frame_bytes) + documents
 
-            if verbose: sys.stderr.write('\rInserted %d of %d records...'
-                                 % (i+1, total_records))
+    def save(self, collection_name, instance, verbose=False, chunk_steps=None):
+        super(Grid4DMediator, self).save(collection_name, instance)
 
+        coords, documents = self.encode(instance, chunk_steps)
+        self.write(collection_name, coords, documents, verbose=verbose)
         self.generate_metadata(collection_name, instance, verbose=verbose)
 
     def summarize(self, collection_name, query={}):
-        df = self.load(collection_name, query)
+        # Summarizes one frame (document) at a time rather than calling load();
+        #   the same as summarizing the columns (axis 0) of the loaded frame
+        cursor = self.client[self.db_name][collection_name].find(query, {
+            'values': 1,
+        })
+
+        stats = dict([(k, []) for k in ('mean', 'min', 'max', 'std', 'median')])
+        for record in cursor:
+            values = pd.Series(record['values'], dtype='float64')
+            for k in stats.keys():
+                stats[k].append(getattr(values, k)())
 
         return {
-            'values': { # Axis 0 is the "row-wise" axis
-                'mean': df.mean(0).mean(),
-                'min': df.min(0).min(),
-                'max': df.max(0).max(),
-                'std': df.std(0).std(),
-                'median': df.median(0).median()
+            'values': {
+                'mean': pd.Series(stats['mean']).mean(),
+                'min': pd.Series(stats['min']).min(),
+                'max': pd.Series(stats['max']).max(),
+                'std': pd.Series(stats['std']).std(),
+                'median': pd.Series(stats['median']).median()
             }
         }
 
@@ -330,12 +510,17 @@ class Grid3DMediator(Mediator):
         # Return None in place of NaN
         return aligned.where((pd.notnull(aligned)), None)
 
-    def load(self, collection_name, query={}):
+    def iter_frames(self, collection_name, query={}):
+        '''
+        Generates an (ISO 8601 timestamp, DataFrame) pair for each record
+        (time step) matching the query, in time order, one at a time e.g. for
+        rendering long time series without loading all of them
+        '''
         # Retrieve a cursor to iterate over the records matching the query
         cursor = self.client[self.db_name][collection_name].find(query, {
             'values': 1,
             'errors': 1,
-        })
+        }).sort('_id', 1)
 
         # Create an n x 2 matrix of the longitude-latitude coordinates
         coords = np.array(self.client[self.db_name]['coord_index'].find({
@@ -345,9 +530,6 @@ class Grid3DMediator(Mediator):
         # Create a DataFrame of longitude-latitude coordinates
         coords = pd.DataFrame(coords, columns=('x', 'y'))
 
-        frames = []
-        ids = []
-
         for record in cursor:
             # Create values and error Series; concatenate them as a DataFrame,
             #   then concatenate them with the coordinates DataFrame
@@ -358,17 +540,14 @@ class Grid3DMediator(Mediator):
                 pd.concat([values, errors], axis=1)
             ], axis=1)
 
-            frames.append(df)
-            ids.append(record.get('_id'))
-
-        # Convert the Python datetime instances to ISO 8601 timestamps
-        ids = map(lambda d: datetime.datetime.strftime(d, '%Y-%m-%dT%H:%M:%S'), ids)
+            # Convert the Python datetime instance to an ISO 8601 timestamp
+            yield (datetime.datetime.strftime(record.get('_id'),
+                '%Y-%m-%dT%H:%M:%S'), df)
 
-        return dict(zip(ids, frames))
-
-    def save(self, collection_name, instance, alignment=None, verbose=False):
-        super(Grid3DMediator, self).save(collection_name, instance)
+    def load(self, collection_name, query={}):
+        return dict(self.iter_frames(collection_name, query))
 
+    def encode(self, instance, alignment=None):
         if alignment is not None:
             df = self.__align__(instance, alignment).reset_index()
 
@@ -379,15 +558,6 @@ class Grid3DMediator(Mediator):
         if instance.timestamp is None:
             raise AttributeError('Expected a model to have a "timestamp" parameter; is this the right model for this Mediator?')
 
-        # Create the index of grid cell coordinates, if needed
-        if self.client[self.db_name]['coord_index'].find({
-            '_id': collection_name
-        }).count() == 0:
-            i = self.client[self.db_name]['coord_index'].insert({
-                '_id': collection_name,
-                'i': df.set_index(['x', 'y']).index.tolist()
-            })
-
         # Create the data document itself
         data_dict = {
             '_id': parser.parse(instance.timestamp)
@@ -404,7 +574,6 @@ class Grid3DMediator(Mediator):
                 data_dict['_span'] = instance.spans[0]
 
         for param in instance.parameters:
-            if verbose: sys.stderr.write('\nProcessing data for parameter: {0}...'.format(param))
             if getattr(instance, 'precision', None) is not None:
                 data_dict[param] = map(lambda x: round(x[1],
                     instance.precision) if x[1] is not None else None, df[param].iterkv())
@@ -412,9 +581,13 @@ class Grid3DMediator(Mediator):
             else:
                 data_dict[param] = df[param].tolist()
 
-        if verbose: sys.stderr.write('\nInserting records...')
+        return (df.set_index(['x', 'y']).index.tolist(), [data_dict])
+
+    def save(self, collection_name, instance, alignment=None, verbose=False):
+        super(Grid3DMediator, self).save(collection_name, instance)
 
-        self.client[self.db_name][collection_name].insert(data_dict)
+        coords, documents = self.encode(instance, alignment)
+        self.write(collection_name, coords, documents, verbose=verbose)
         self.generate_metadata(collection_name, instance)
 
 
@@ -424,6 +597,7 @@ class Unstructured3DMediator(Mediator):
     positions given as longitude-latitude pairs; two spatial dimensions, one
     value dimension (3D).
     '''
+    document_bytes = 200 # Each row is a document (dictionaries) of its own
 
     def load(self, collection_name, query={}):
         # Retrieve a cursor to iterate over the records matching the query
@@ -460,9 +634,7 @@ class Unstructured3DMediator(Mediator):
 
         return pd.concat(series, axis=1)
 
-    def save(self, collection_name, instance, verbose=False):
-        super(Unstructured3DMediator, self).save(collection_name, instance)
-
+    def encode(self, instance):
         is_multi = (instance.geometry.get('type')[0:5] == 'Multi')
 
         df = instance.extract()
@@ -479,32 +651,199 @@ class Unstructured3DMediator(Mediator):
 
             features.append(data_dict)
 
-        # Create the index of grid cell coordinates, if needed
-        if self.client[self.db_name]['coord_index'].find({
-            '_id': collection_name
-        }).count() == 0:
-            i = self.client[self.db_name]['coord_index'].insert({
-                '_id': collection_name,
-                'i': df.set_index(['x', 'y']).index.tolist()
-            })
+        coords = df.set_index(['x', 'y']).index.tolist()
 
         # If it's a collection, we can assume each data member is unique;
         #   we insert a single document
         if is_multi:
-            if verbose:
-                sys.stderr.write('\nInserting records...')
-
-            j = self.client[self.db_name][collection_name].insert({
-                'features': features
-            })
+            return (coords, [{'features': features}])
 
         # Otherwise, each data member may not be unique e.g. each is a POINT
         #   among potentially other POINTs at the same date/time
-        else:
-            total_records = len(features)
-            for i, feature in enumerate(features):
-                j = self.client[self.db_name][collection_name].insert(feature)
-                if verbose:
-                    sys.stderr.write('\rInserted %d of %d records...' % (i + 1, total_records))
+        return (coords, features)
+
+    def save(self, collection_name, instance, verbose=False):
+        super(Unstructured3DMediator, self).save(collection_name, instance)
 
+        coords, documents = self.encode(instance)
+        self.write(collection_name, coords, documents, verbose=verbose)
         self.generate_metadata(collection_name, instance)
+
+
+class CovarianceMediator(Mediator):
+    '''
+    Mediator that understands a (symmetric) covariance matrix, stored as
+    square tiles of tile_size rows and columns. Only the tiles on or above
+    the diagonal are stored, and only the upper triangle of the tiles on the
+    diagonal; each tile is one document, with its values as packed,
+    little-endian 64-bit floats. A block of rows and columns (or a row) can
+    then be loaded by fetching only the tiles it overlaps.
+    '''
+    dtype = np.dtype('<f8')
+    parallel = False # A worker would return every tile of the matrix at once
+    tile_size = 256
+
+    def __init__(self, client=None, db_name=DB, tile_size=None):
+        super(CovarianceMediator, self).__init__(client, db_name)
+        if tile_size is not None:
+            self.tile_size = tile_size
+
+    def __layout__(self, collection_name):
+        # Returns the number of rows (and columns) and the tile size
+        metadata = self.client[self.db_name]['metadata'].find({
+            '_id': collection_name
+        }).next()
+
+        return (metadata['shape'][0], metadata['tile_size'])
+
+    def __tile__(self, document):
+        # Unpacks a tile document as a dense array
+        values = np.frombuffer(document['values'], dtype=self.dtype)
+        rows, cols = document['shape']
+        if not document['diagonal']:
+            return values.reshape((rows, cols))
+
+        # Tiles on the diagonal hold their upper triangle only
+        tile = np.zeros((rows, cols))
+        upper = np.triu_indices(rows)
+        tile[upper] = values
+        tile.T[upper] = values
+        return tile
+
+    def __tiles__(self, instance, tile_size):
+        # Generates a document for each tile on or above the diagonal,
+        #   reading one row of tiles at a time
+        for start, block in instance.iter_blocks(tile_size):
+            i = start // tile_size
+            for j in range(i, int(np.ceil(block.shape[1] / float(tile_size)))):
+                tile = block[:, (j * tile_size):((j + 1) * tile_size)]
+                if i == j:
+                    values = tile[np.triu_indices(tile.shape[0])]
+
+                else:
+                    values = tile.ravel()
+
+                yield {
+                    '_id': '%d,%d' % (i, j),
+                    'diagonal': (i == j),
+                    'i': i,
+                    'j': j,
+                    'shape': list(tile.shape),
+                    'values': Binary(values.astype(self.dtype).tostring())
+                }
+
+    def describe(self, instance, coords, tile_size=None):
+        # The shape and tile size are needed to find the tiles of a block
+        metadata = dict(instance.describe())
+        metadata.update({
+            'shape': [len(coords), len(coords)],
+            'tile_size': tile_size or self.tile_size
+        })
+        return metadata
+
+    def encode(self, instance, tile_size=None):
+        '''
+        Encodes each tile on or above the diagonal as a document; the rows
+        of the matrix are read (and the documents generated, as they are
+        inserted) one row of tiles at a time. The coordinates are the row
+        numbers.
+        '''
+        tile_size = tile_size or self.tile_size
+        n = instance.file.get(instance.var_name).shape[0]
+
+        return (range(n), self.__tiles__(instance, tile_size))
+
+    def estimate(self, shape, itemsize=8, materialize=False, tile_size=None):
+        # One row of tiles is read at a time; the tiles are packed binary
+        n = shape[0]
+        rows = min(tile_size or self.tile_size, n)
+        tiles = (n * (n + 1) // 2) if materialize else (rows * n)
+        return rows * n * (itemsize + self.frame_bytes) + tiles * self.dtype.itemsize
+
+    def iter_blocks(self, collection_name, chunk_rows=None):
+        '''
+        Generates (first row, block of rows) pairs of (at most) chunk_rows
+        rows (by default, one row of tiles) e.g. for
+        fluxpy.covariance.quadratic_forms()
+        '''
+        n, tile_size = self.__layout__(collection_name)
+        chunk_rows = chunk_rows or tile_size
+        for start in range(0, n, chunk_rows):
+            yield (start, self.load_block(collection_name,
+                (start, min(start + chunk_rows, n)), (0, n)))
+
+    def load(self, collection_name, query={}):
+        '''Returns the entire (dense) matrix as a DataFrame'''
+        n, tile_size = self.__layout__(collection_name)
+        return pd.DataFrame(self.load_block(collection_name, (0, n), (0, n)))
+
+    def load_block(self, collection_name, rows, cols):
+        '''
+        Returns the block of the matrix with the given rows and columns, each
+        a (start, stop) pair or a slice (with the default step); only the
+        tiles that overlap the block are fetched.
+        '''
+        n, tile_size = self.__layout__(collection_name)
+        rows = slice(*rows) if isinstance(rows, tuple) else rows
+        cols = slice(*cols) if isinstance(cols, tuple) else cols
+        r0, r1 = rows.indices(n)[0:2]
+        c0, c1 = cols.indices(n)[0:2]
+
+        # Each tile (i, j) below the diagonal is the transpose of tile (j, i)
+        needed = [(i, j)
+            for i in range(r0 // tile_size, (r1 - 1) // tile_size + 1)
+            for j in range(c0 // tile_size, (c1 - 1) // tile_size + 1)]
+        ids = set(['%d,%d' % (min(i, j), max(i, j)) for i, j in needed])
+        documents = dict([(d['_id'], d) for d in self.client[self.db_name][collection_name].find({
+            '_id': {'$in': list(ids)}
+        })])
+
+        result = np.empty((max(r1 - r0, 0), max(c1 - c0, 0)))
+        for i, j in needed:
+            tile = self.__tile__(documents['%d,%d' % (min(i, j), max(i, j))])
+            if i > j:
+                tile = tile.T
+
+            # The intersection of the tile and the block, in matrix indices
+            top, left = i * tile_size, j * tile_size
+            a, b = max(r0, top), min(r1, top + tile.shape[0])
+            c, d = max(c0, left), min(c1, left + tile.shape[1])
+            result[(a - r0):(b - r0), (c - c0):(d - c0)] = tile[(a - top):(b - top),
+                (c - left):(d - left)]
+
+        return result
+
+    def load_row(self, collection_name, i):
+        '''Returns row (and column) i of the matrix'''
+        n, tile_size = self.__layout__(collection_name)
+        return self.load_block(collection_name, (i, i + 1), (0, n))[0]
+
+    def save(self, collection_name, instance, verbose=False, tile_size=None):
+        super(CovarianceMediator, self).save(collection_name, instance)
+
+        coords, documents = self.encode(instance, tile_size)
+        self.write(collection_name, coords, documents, verbose=verbose)
+        self.generate_metadata(collection_name, instance, verbose=verbose,
+            metadata=self.describe(instance, coords, tile_size))
+
+    def summarize(self, collection_name, query={}):
+        # Summarizes the variances (the diagonal), read from the tiles on
+        #   the diagonal, rather than all N-squared covariances
+        cursor = self.client[self.db_name][collection_name].find({
+            'diagonal': True
+        })
+
+        variances = []
+        for document in cursor:
+            variances.extend(np.diagonal(self.__tile__(document)).tolist())
+
+        values = pd.Series(variances, dtype='float64')
+        return {
+            'values': {
+                'mean': values.mean(),
+                'min': values.min(),
+                'max': values.max(),
+                'std': values.std(),
+                'median': values.median()
+            }
+        }
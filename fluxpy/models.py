@@ -4,17 +4,22 @@ flat files and hierarchical files (e.g. HDF5) to Python pandas Data Frames.
 '''
 
 import datetime
+import functools
 import json
 import math
 import os
 import re
 import sys
+import types
 import pandas as pd
 import numpy as np
-import scipy.io
 import h5py
 from dateutil.relativedelta import *
 from fluxpy import ISO_8601
+from fluxpy.arrays import ArrayFile, Columns
+from fluxpy.cache import ExtractionCache
+from fluxpy.covariance import PackedCovariance, block_dot
+from fluxpy.matlab import MatFile, is_hdf5
 from shapely.geometry import MultiPoint
 
 try:
@@ -23,6 +28,131 @@ try:
 except ImportError:
     import md5
 
+# Transforms that can be named in a configuration (or given as the equivalent
+#   function from the math module) are applied as NumPy ufuncs
+UFUNCS = {
+    'abs': np.abs,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'sqrt': np.sqrt,
+    'square': np.square
+}
+
+MATH_UFUNCS = {
+    abs: np.abs,
+    math.exp: np.exp,
+    math.fabs: np.abs,
+    math.log: np.log,
+    math.log10: np.log10,
+    math.sqrt: np.sqrt
+}
+
+def compile_format(fmt):
+    '''
+    Compiles a string format into a function of an array of values. A
+    fixed-precision format (e.g. "%.5f") becomes decimal rounding with
+    np.round(); any other format falls back to formatting and parsing each
+    value. The two differ for some values half-way between two rounded
+    values, e.g. 0.015 (stored as slightly less) is formatted as "0.01" but
+    rounded to 0.02: np.round() multiplies by a power of ten, inexactly,
+    before rounding half to even, while formatting rounds the exact value.
+    '''
+    match = re.match(r'^%\.(?P<decimals>\d+)f$', fmt)
+    if match is not None:
+        decimals = int(match.group('decimals'))
+
+        # Formatted values were always parsed as Python (64-bit) floats
+        return lambda values: np.round(values.astype(np.float64), decimals)
+
+    return np.vectorize(lambda x: float(fmt % x), otypes=[np.float64])
+
+
+def compile_transform(transform):
+    '''
+    Compiles a transform into a function of an array of values. A transform
+    may be the name of a ufunc in UFUNCS, a NumPy ufunc, one of the math
+    functions in MATH_UFUNCS or, as a fallback, any other callable that is
+    applied to each value.
+    '''
+    if isinstance(transform, basestring):
+        return UFUNCS[transform]
+
+    if isinstance(transform, np.ufunc):
+        return transform
+
+    if transform in MATH_UFUNCS:
+        return MATH_UFUNCS[transform]
+
+    return np.vectorize(transform, otypes=[np.float64])
+
+
+def stable_repr(value, strict=False):
+    '''
+    Returns a representation of a configuration value that is the same in
+    every process, unlike the repr() of a function (which includes its
+    address): a NumPy ufunc or built-in function is represented by its name
+    and a Python function by its module, name and code, with its default
+    arguments and closure. Any other callable (e.g. an instance with a
+    __call__() method) is represented by its repr() or, if strict, raises a
+    TypeError.
+    '''
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(['%s: %s' % (stable_repr(k, strict),
+            stable_repr(v, strict)) for k, v in sorted(value.items())])
+
+    if isinstance(value, (list, tuple)):
+        return '%s(%s)' % (type(value).__name__,
+            ', '.join([stable_repr(v, strict) for v in value]))
+
+    if isinstance(value, np.ufunc):
+        return 'ufunc %s' % value.__name__
+
+    if isinstance(value, types.BuiltinFunctionType):
+        return 'builtin %s.%s' % (value.__module__, value.__name__)
+
+    if isinstance(value, types.FunctionType):
+        return 'function %s.%s%s' % (value.__module__, value.__name__,
+            stable_repr((value.__code__, value.__defaults__,
+                [cell.cell_contents for cell in value.__closure__ or ()]), strict))
+
+    if isinstance(value, types.CodeType):
+        return 'code %r%s' % ((value.co_code, value.co_names),
+            stable_repr(value.co_consts, strict))
+
+    if strict and callable(value) and not isinstance(value, type):
+        raise TypeError('Callable %r has no representation that is the same in every process' % value)
+
+    return repr(value)
+
+
+def memoized(method):
+    '''
+    Decorates a TransformationInterface method, e.g. extract() or describe(),
+    so that its result is remembered for the instance's effective
+    configuration. Keyword arguments are applied as configuration overrides
+    first. Calls with a DataFrame (e.g. describe(df)) are not memoized. Each
+    call returns the remembered result itself, not a copy (a DataFrame from
+    the on-disk cache is a copy-on-write memory map), so callers must not
+    modify it in place; those that need to (e.g.
+    Mediator.generate_metadata()) copy it first.
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if args or kwargs.get('df') is not None:
+            return method(self, *args, **kwargs)
+
+        kwargs.pop('df', None)
+        self.__configure__(**kwargs)
+        if method.__name__ in self.disk_cached:
+            return self.__memoize__(method.__name__,
+                lambda: self.__disk_cache__(lambda: method(self)))
+
+        return self.__memoize__(method.__name__, lambda: method(self))
+
+    return wrapper
+
+
 class TransformationInterface(object):
     '''
     An abstract persistence transformation interface (modified from
@@ -31,18 +161,49 @@ class TransformationInterface(object):
     arguments (they must default to None). The dump() method must take only one
     argument which is the interchange datum (a dictionary). A configuration
     file may be provided as a *.json* file with the same name as the data file.
+    The results of extract() and describe() are memoized until the effective
+    configuration changes, so the file is read only once. If the "cache_dir"
+    option is set, the result of extract() is also stored in that directory
+    (see fluxpy.cache), so that it can be memory-mapped when the same file
+    is extracted again with the same configuration, e.g. in another process;
+    not if a transform is a callable that cannot be told apart from another
+    in another process (see stable_repr()).
     '''
     path_regex = re.compile(r'.+\.(?P<extension>mat|h5)')
     var_regex = re.compile(r'^(?!__).*(?!__)$') # Skips __private__ variable names
 
+    # Attributes, in addition to the configuration options, that determine
+    #   what extract() and describe() return
+    effective_config = ('columns', 'formats', 'grid', 'gridded', 'parameters',
+        'precision', 'spans', 'steps', 'timestamp', 'title', 'transforms',
+        'units', 'var_name')
+
+    # Configuration options that do not change what extract() returns
+    ineffective_config = ('cache_dir', 'cache_size')
+
+    # Methods whose results are stored in the on-disk cache, if any
+    disk_cached = ('extract',)
+
     def __init__(self, path, config_file=None, *args, **kwargs):
         self.config = dict()
 
+        # Arrays in memory (see from_arrays()) are not a file
+        if isinstance(path, ArrayFile):
+            self.file_handler = lambda f: f
+            if config_file:
+                self.config = json.load(open(config_file, 'rb'))
+
+            self.__configure__(**kwargs)
+            self.__open__(path)
+            return
+
         if self.path_regex.match(path) is None:
             raise AttributeError('Only Matlab (*.mat) and HDF5 (*.h5 or *.mat) files are accepted')
 
+        self.path = path
+
         if self.path_regex.match(path).groupdict().get('extension') == 'mat':
-            self.file_handler = scipy.io.loadmat
+            self.file_handler = MatFile
 
         else:
             self.file_handler = h5py.File
@@ -67,13 +228,83 @@ class TransformationInterface(object):
         # Open the hierarchical file
         self.__open__(path)
             
+    @classmethod
+    def from_arrays(cls, *arrays, **kwargs):
+        '''
+        Creates an instance from NumPy arrays in memory instead of a file;
+        the arrays are the blocks of columns of the data, in the order the
+        model expects, e.g. the coordinates and then the values:
+
+            SpatioTemporalMatrix.from_arrays(coords, values,
+                timestamp='2004-06-30T00:00:00', steps=[10800])
+
+        Configuration options (and optionally a config_file) are given as
+        keyword arguments. The arrays are not copied; only the rows and
+        columns that are read are copied, as they would be from a file.
+        '''
+        name = kwargs.pop('var_name', 'data')
+        return cls(ArrayFile({name: Columns(*arrays)}), var_name=name, **kwargs)
+
+    def __compile__(self):
+        # Compiles the transforms, then the formats, into a sequence of
+        #   (column, function of an array) pairs
+        compiled = []
+        if isinstance(getattr(self, 'transforms', None), dict):
+            for col, transform in self.transforms.items():
+                if transform is not None:
+                    compiled.append((col, compile_transform(transform)))
+
+        for col, fmt in getattr(self, 'formats', {}).items():
+            compiled.append((col, compile_format(fmt)))
+
+        return compiled
+
+    def __config_key__(self, strict=False):
+        # Fingerprints the effective configuration, the same way in every
+        #   process; see stable_repr()
+        keys = sorted(set(self.config.keys()).union(self.effective_config)\
+            .difference(self.ineffective_config))
+        return md5(stable_repr([(k, getattr(self, k, None)) for k in keys],
+            strict)).hexdigest()
+
     def __configure__(self, **kwargs):
+        # Any change in the configuration invalidates memoized results
+        for key, value in kwargs.items():
+            if getattr(self, key, None) != value:
+                self.__cache__ = None
+                break
+
         self.config.update(kwargs)
 
         # Set as attributes all of the configuration values
         for config in self.config.keys():
             setattr(self, config, self.config.get(config))
 
+    def __disk_cache__(self, func):
+        # Returns the DataFrame from the on-disk cache, if there is one and
+        #   it has an entry for this file and configuration; otherwise,
+        #   returns the result of func(), storing it in the cache
+        if getattr(self, 'cache_dir', None) is None or getattr(self, 'path', None) is None:
+            return func()
+
+        # Another process could never find an entry for a configuration
+        #   with e.g. a callable instance as a transform
+        try:
+            config_key = self.__config_key__(strict=True)
+
+        except TypeError:
+            return func()
+
+        cache = ExtractionCache(self.cache_dir, getattr(self, 'cache_size', None))
+        key = cache.key(self.path, self.__class__, config_key)
+
+        df = cache.get(key)
+        if df is None:
+            df = func()
+            cache.put(key, df)
+
+        return df
+
     def __date_series__(self, df=None, steps=None):
         if df is not None:
             steps = df.shape[1]
@@ -90,12 +321,11 @@ class TransformationInterface(object):
         return dates
 
     def __open__(self, path, var_name=None):
-        try:
-            self.file = self.file_handler(path) # HDF5/Matlab file interface
-
-        except NotImplementedError:
+        # Matlab v7.3 files are HDF5 files; tell them apart by the header
+        if self.file_handler is MatFile and is_hdf5(path):
             self.file_handler = h5py.File
-            self.file = self.file_handler(path)
+
+        self.file = self.file_handler(path) # HDF5/Matlab file interface
 
         # Infer var_name; grab the first variable name that isn't __private__
         if var_name is None and getattr(self, 'var_name', None) is None:
@@ -103,6 +333,55 @@ class TransformationInterface(object):
                 k for k in self.file.keys() if self.var_regex.match(k) is not None
             ][0]
 
+    def __read__(self, selection=Ellipsis, var_name=None):
+        # Reads (a selection e.g. a hyperslab of) a variable as a new array,
+        #   which can be altered in place (e.g. by transforms) without altering
+        #   the data held by the file handler (or memory-mapped from the file)
+        data = self.file.get(var_name or self.var_name)
+        if isinstance(data, np.ndarray):
+            return np.array(data[selection])
+
+        return data[selection]
+
+    def __extracted__(self):
+        # The remembered result of extract() for the effective configuration,
+        #   if any, so that describe() need not read the file again
+        cache = getattr(self, '__cache__', None)
+        if cache is None or cache['key'] != self.__config_key__():
+            return None
+
+        return cache.get('extract')
+
+    def __memoize__(self, name, func):
+        # Returns the remembered result of func() for the effective
+        #   configuration, calling it only if there is none
+        key = self.__config_key__()
+        if getattr(self, '__cache__', None) is None or self.__cache__['key'] != key:
+            self.__cache__ = {'key': key}
+
+        cache = self.__cache__
+        if not cache.has_key(name):
+            cache[name] = func()
+
+        return cache[name]
+
+    def __read_columns__(self, columns):
+        # Reads only the named columns (e.g. the coordinate columns) of the
+        #   variable, with any transforms and formats applied
+        columns = sorted(columns, key=self.columns.index)
+        df = pd.DataFrame(self.__read__(np.s_[:, map(self.columns.index, columns)]),
+            columns=columns)
+
+        return self.__transform__(df)
+
+    def __transform__(self, df):
+        # Applies the compiled transforms and formats to the DataFrame's columns
+        for col, func in self.__memoize__('__compile__', self.__compile__):
+            if col in df.columns:
+                df[col] = func(df[col].values)
+
+        return df
+
     def describe(self, df=None, **kwargs):
         if getattr(self, '__metadata__', None) is None:
             self.__metadata__ = dict()
@@ -128,6 +407,24 @@ class TransformationInterface(object):
     def extract(self, *args, **kwargs):
         pass
 
+    def inspect(self, **kwargs):
+        '''
+        Returns the metadata that describe() creates, along with the name,
+        shape and dtype of the variable and the names of all the variables in
+        the file; only the coordinate columns are read, not the data values.
+        '''
+        self.__configure__(**kwargs)
+
+        metadata = dict(self.describe())
+        metadata.update({
+            'dtype': str(self.file.get(self.var_name).dtype),
+            'shape': self.file.get(self.var_name).shape,
+            'var_name': self.var_name,
+            'variables': list(self.file.keys())
+        })
+
+        return metadata
+
 
 class CovarianceMatrix(TransformationInterface):
     '''
@@ -149,9 +446,11 @@ class CovarianceMatrix(TransformationInterface):
 
         super(CovarianceMatrix, self).__init__(path, *args, **kwargs)
 
+    @memoized
     def describe(self, df=None, **kwargs):
-        if df is None:
-            df = self.extract(**kwargs)
+        # The metadata do not depend on the data values
+        if getattr(self, 'timestamp', None) is None:
+            raise AttributeError('One or more required configuration parameters were not provided')
 
         self.__metadata__ = {
             'dates': [self.timestamp],
@@ -163,6 +462,7 @@ class CovarianceMatrix(TransformationInterface):
 
         return self.__metadata__
 
+    @memoized
     def extract(self, *args, **kwargs):
         '''Creates a DataFrame properly encapsulating the associated file data'''
 
@@ -172,14 +472,48 @@ class CovarianceMatrix(TransformationInterface):
         if getattr(self, 'timestamp', None) is None:
             raise AttributeError('One or more required configuration parameters were not provided')
 
-        df = pd.DataFrame(self.file.get(self.var_name)[:])
+        df = pd.DataFrame(self.__read__())
         assert df.shape[0] == df.shape[1], 'Expected a square matrix (covariance matrix)'
 
         if self.precision is not None:
-            df = df.apply(lambda col: col.map(lambda x: float(('%%.%df' % self.precision) % x)))
+            df = pd.DataFrame(np.round(df.values, self.precision))
 
         return df
 
+    def dot(self, other, chunk_rows=1000):
+        '''
+        Returns the product of the covariance matrix and a vector or matrix
+        (other), reading one block of chunk_rows rows at a time
+        '''
+        return block_dot(self.file.get(self.var_name).shape[0],
+            self.iter_blocks(chunk_rows), other)
+
+    def iter_blocks(self, chunk_rows=1000):
+        '''
+        Generates (first row, block of rows) pairs, reading (at most)
+        chunk_rows rows of the matrix at a time (as hyperslabs, for HDF5
+        files), with the precision fixed
+        '''
+        shape = self.file.get(self.var_name).shape
+        assert shape[0] == shape[1], 'Expected a square matrix (covariance matrix)'
+
+        for start in range(0, shape[0], chunk_rows):
+            block = self.__read__(np.s_[start:min(start + chunk_rows, shape[0]), :])
+            if self.precision is not None:
+                block = np.round(block, self.precision)
+
+            yield (start, block)
+
+    def pack(self, chunk_rows=1000, tolerance=None):
+        '''
+        Returns a PackedCovariance that stores only the upper triangle of the
+        matrix, read one block of rows at a time; if a tolerance is given,
+        off-diagonal entries no greater than it (in absolute value) are
+        dropped and the upper triangle is stored as a sparse matrix.
+        '''
+        return PackedCovariance.from_blocks(self.file.get(self.var_name).shape[0],
+            self.iter_blocks(chunk_rows), tolerance=tolerance)
+
 
 class SpatioTemporalMatrix(TransformationInterface):
     '''
@@ -210,12 +544,10 @@ class SpatioTemporalMatrix(TransformationInterface):
 
         super(SpatioTemporalMatrix, self).__init__(path, config_file, *args, **kwargs)
 
-    def describe(self, df=None, **kwargs):
-        if df is None:
-            df = self.extract(**kwargs)
-
-        bounds = MultiPoint(list(df.index.values)).bounds
-        dates = self.__date_series__(df)
+    def __describe__(self, index, steps):
+        # Creates metadata from the index of grid cells and the number of steps
+        bounds = MultiPoint(list(index.values)).bounds
+        dates = self.__date_series__(None, steps)
 
         self.__metadata__ = {
             'dates': map(lambda t: t.strftime(ISO_8601),
@@ -224,10 +556,30 @@ class SpatioTemporalMatrix(TransformationInterface):
             'bboxmd5': md5(str(bounds)).hexdigest()
         }
 
-        super(SpatioTemporalMatrix, self).describe(df, **kwargs)
+        super(SpatioTemporalMatrix, self).describe()
 
         return self.__metadata__
 
+    @memoized
+    def describe(self, df=None, **kwargs):
+        df = self.__extracted__() if df is None else df
+        if df is not None:
+            return self.__describe__(df.index, df.shape[1])
+
+        # Read only the coordinate columns; the number of steps is known
+        #   from the shape of the variable
+        if getattr(self, 'timestamp', None) is None:
+            raise AttributeError('One or more required configuration parameters were not provided')
+
+        if self.file.get(self.var_name) is None:
+            raise ValueError('Could not get at the variable named "%s"' % self.var_name)
+
+        index = self.__read_columns__(self.columns).set_index(self.columns).index
+        steps = self.file.get(self.var_name).shape[1] - len(self.columns)
+
+        return self.__describe__(index, steps)
+
+    @memoized
     def extract(self, *args, **kwargs):
         '''Creates a DataFrame properly encapsulating the associated file data'''
 
@@ -254,29 +606,55 @@ class SpatioTemporalMatrix(TransformationInterface):
 
         # Data frame
         try:
-            df = pd.DataFrame(self.file.get(self.var_name)[:], columns=cols)
+            df = pd.DataFrame(self.__read__(), columns=cols)
 
         except TypeError:
             raise ValueError('Could not get at the variable named "%s"' % self.var_name)
 
-        # Apply any data transforms
-        if isinstance(self.transforms, dict):
-            for col, transform in self.transforms.items():
-                if transform is not None:
-                    df[col] = df[col].apply(transform)
-
-        # Fix the precision of data values
-        for col in self.formats.keys():
-            df[col] = df[col].map(lambda x: float(self.formats[col] % x))
+        # Apply any data transforms; fix the precision of data values
+        df = self.__transform__(df)
 
         # Capture a new DataFrame with a MultiIndex; promotes these columns to indexes
         dfm = df.set_index(self.columns)
 
-        # Create metadata
-        self.describe(dfm)
+        # Create metadata, remembered as describe() would be
+        self.__memoize__('describe', lambda: self.__describe__(dfm.index, dfm.shape[1]))
 
         return dfm
 
+    def iter_extract(self, chunk_steps=100, **kwargs):
+        '''
+        Generates the DataFrame that extract() creates in blocks of (at most)
+        chunk_steps time steps (columns); only the coordinate columns and
+        one block of time steps are read from the file at a time (as
+        hyperslabs, for HDF5 files), so memory use is bounded by the size
+        of a block.
+        '''
+        self.__configure__(**kwargs)
+
+        if getattr(self, 'timestamp', None) is None:
+            raise AttributeError('One or more required configuration parameters were not provided')
+
+        if self.file.get(self.var_name) is None:
+            raise ValueError('Could not get at the variable named "%s"' % self.var_name)
+
+        n = len(self.columns)
+        steps = self.file.get(self.var_name).shape[1] - n
+        dates = self.__date_series__(None, steps)
+
+        # Read the coordinate columns once; they index every block
+        index = self.__read_columns__(self.columns).set_index(self.columns).index
+
+        # Create metadata, as extract() would, without reading any values
+        self.__memoize__('describe', lambda: self.__describe__(index, steps))
+
+        for start in range(0, steps, chunk_steps):
+            stop = min(start + chunk_steps, steps)
+            block = pd.DataFrame(self.__read__(np.s_[:, (n + start):(n + stop)]),
+                index=index, columns=dates[start:stop])
+
+            yield self.__transform__(block)
+
 
 class XCO2Matrix(TransformationInterface):
     '''
@@ -319,14 +697,36 @@ class XCO2Matrix(TransformationInterface):
 
         super(XCO2Matrix, self).__init__(path, *args, **kwargs)
 
+    def __dates__(self, timestamps):
+        # Creates the list of unique dates, most recent first
+        dates = np.unique(timestamps.values.astype('datetime64[s]'))[::-1]
+        return np.datetime_as_string(dates, unit='s').tolist()
+
+    def __timestamps__(self, df):
+        # Creates the timestamp of each retrieval from its day of the year
+        #   (days after January 1) and year, truncated to integers
+        years = df['%Y'].values.astype(np.int64) - 1970
+        days = df['%j'].values.astype(np.int64)
+        t = years.astype('datetime64[Y]') + days.astype('timedelta64[D]')
+
+        return pd.Series(t.astype('datetime64[ns]'), index=df.index)
+
+    @memoized
     def describe(self, df=None, **kwargs):
+        df = self.__extracted__() if df is None else df
         if df is None:
-            df = self.extract(**kwargs)
+            # Read only the coordinate and date columns
+            if getattr(self, 'timestamp', None) is None:
+                raise AttributeError('One or more required configuration parameters were not provided')
 
-        bounds = MultiPoint(df.set_index(['x', 'y']).index.tolist()).bounds
-        dates = df['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S'))\
-            .unique().tolist()
-        dates.sort(lambda x, y: cmp(y, x))
+            df = self.__read_columns__(['x', 'y', '%j', '%Y'])
+            df['timestamp'] = self.__timestamps__(df)
+
+        # The same bounds as MultiPoint(...).bounds, without creating a Point
+        #   for every retrieval
+        bounds = tuple(map(float, (df['x'].min(), df['y'].min(),
+            df['x'].max(), df['y'].max())))
+        dates = self.__dates__(df['timestamp'])
 
         self.__metadata__ = {
             'dates': dates,
@@ -338,6 +738,7 @@ class XCO2Matrix(TransformationInterface):
 
         return self.__metadata__
 
+    @memoized
     def extract(self, *args, **kwargs):
         '''Creates a DataFrame properly encapsulating the associated file data'''
 
@@ -352,24 +753,19 @@ class XCO2Matrix(TransformationInterface):
         
         # Data frame
         try:
-            df = pd.DataFrame(self.file.get(self.var_name)[:], columns=self.columns)
+            df = pd.DataFrame(self.__read__(), columns=self.columns)
             
         except TypeError:
             raise ValueError('Could not get at the variable named "%s"' % self.var_name)
 
         # Add and populate a timestamp field
-        t = []
-        for i, series in df.iterrows():
-            t.append(datetime.datetime(int(series['%Y']), 1, 1) + datetime.timedelta(days=int(series['%j'])))
-            
-        df['timestamp'] = pd.Series(t, dtype='datetime64[ns]')
+        df['timestamp'] = self.__timestamps__(df)
 
         # Re-order columns; dispose of extraneous columns            
         # df = df.loc[:,['x', 'y', 't', 'value', 'error']]
 
         # Fix the precision of data values
-        for col in self.formats.keys():
-            df[col] = df[col].map(lambda x: float(self.formats[col] % x))
+        df = self.__transform__(df)
         
         return df
 
@@ -406,7 +802,7 @@ class KrigedXCO2Matrix(TransformationInterface):
             }
         }
         self.transforms = {
-            'errors': lambda x: math.sqrt(x)
+            'errors': 'sqrt'
         }
         self.units = {
             'x': 'degrees',
@@ -419,9 +815,15 @@ class KrigedXCO2Matrix(TransformationInterface):
 
         super(KrigedXCO2Matrix, self).__init__(path, *args, **kwargs)
 
+    @memoized
     def describe(self, df=None, **kwargs):
+        df = self.__extracted__() if df is None else df
         if df is None:
-            df = self.extract(**kwargs)
+            # Read only the coordinate columns
+            if getattr(self, 'timestamp', None) is None:
+                raise AttributeError('One or more required configuration parameters were not provided')
+
+            df = self.__read_columns__(['x', 'y'])
 
         bounds = MultiPoint(df.set_index(['x', 'y']).index.tolist()).bounds
 
@@ -435,6 +837,7 @@ class KrigedXCO2Matrix(TransformationInterface):
 
         return self.__metadata__
     
+    @memoized
     def extract(self, *args, **kwargs):
         '''Creates a DataFrame properly encapsulating the associated file data'''
 
@@ -447,7 +850,7 @@ class KrigedXCO2Matrix(TransformationInterface):
         if not all((self.var_name, self.timestamp)):
             raise AttributeError('One or more required configuration parameters were not provided')
 
-        file_data = self.file.get(self.var_name)[:]
+        file_data = self.__read__()
         assert file_data.shape[1] == len(self.columns), 'Mismatched number of columns and number of fields in the data'
 
         # Data frame
@@ -457,15 +860,8 @@ class KrigedXCO2Matrix(TransformationInterface):
         except TypeError:
             raise ValueError('Could not get at the variable named "%s"' % self.var_name)
 
-        # Apply any data transforms
-        if isinstance(self.transforms, dict):
-            for col, transform in self.transforms.items():
-                if transform is not None:
-                    df[col] = df[col].apply(transform)
-
-        # Fix the precision of data values
-        for col in self.formats.keys():
-            df[col] = df[col].map(lambda x: float(self.formats[col] % x))
+        # Apply any data transforms; fix the precision of data values
+        df = self.__transform__(df)
 
         return df
 
@@ -5,57 +5,98 @@ to return a string or sequence of strings where each string is a file system
 path (either a directory or a file).
 '''
 
-import datetime, os, sys, re, math, warnings
+import datetime, io, itertools, multiprocessing, os, shutil, sys, re, math, warnings
 import numpy as np
+import pandas as pd
+import matplotlib.image as mpimage
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+from collections import OrderedDict
 from zipfile import ZipFile, ZIP_DEFLATED
 from matplotlib.collections import PatchCollection
 from pykml.factory import nsmap
 from pykml.factory import KML_ElementMaker as KML
 from pykml.factory import GX_ElementMaker as GX
 from lxml import etree
-from shapely.geometry import Point
 from fluxpy import DB, DEFAULT_PATH, RESERVED_COLLECTION_NAMES
+from fluxpy import classification
 from fluxpy.colors import COLORS, DivergingColors, SequentialColors
 
+try:
+    from hashlib import md5
+
+except ImportError:
+    import md5
+
+def format_unique(values, fmt=None):
+    '''
+    Formats an array of numbers as an (object) array of strings, formatting
+    each of the unique numbers only once; by default, as str() formats a
+    Python float.
+    '''
+    fmt = fmt or (lambda x: str(float(x)))
+    unique, inverse = np.unique(values, return_inverse=True)
+    return np.array(map(fmt, unique), dtype=object)[inverse]
+
+
+def _render_frame(i):
+    '''
+    Renders frame i of the rendering in progress; run in a worker process
+    forked by AbstractGridView.__render_frames__().
+    '''
+    view, frames, args = _rendering
+    ident, df = frames[i]
+    return view.__render_frame__(i, ident, df, *args)
+
+
+_rendering = None # The (view, frames, arguments) of a parallel rendering
+
+# The namespace declarations of a pykml element serialized on its own e.g.
+#   ' xmlns:atom="..." xmlns:gx="..." xmlns="..."'; see __write__()
+NS_DECLARATIONS = etree.tostring(KML.Document())[len('<Document'):-len('/>')]
+
 class AbstractGridView:
     '''
-    An abstract class of gridded outputs.
+    An abstract class of gridded outputs. The resolution of the model's grid
+    (its "x" and "y") is the width of a grid cell; each cell is drawn
+    centered on its centroid, half that width on either side.
     '''
     alpha = 1.0
     colors = dict([(n, SequentialColors(n)) for n in COLORS.keys()])
     filename_pattern = '%s_%d.kml' # Must have %s and %d format strings in name
+    geometry_cache_size = 8 # Number of grids of which the cell geometry is cached
     legend_size = (2.5, 5.0) # Size of the legend in inches
 
     def __init__(self, mediator, model, collection_name):
+        self.__geometries__ = OrderedDict() # See __square_geometry__()
         self.mediator = mediator
         self.model = model
         self.collection_name = collection_name
         self.field_units = dict(zip(model.columns, model.units))
 
-    def __breakpoints__(self, series, bins):
-        if not isinstance(bins, int):
-            raise TypeError('Integer bins argument expected')
+    def __breakpoints__(self, series, bins, stats=None):
+        # Breakpoints of bins classes about the mean of the series or, if
+        #   given, the (mean, standard deviation); bins may instead be a
+        #   (scheme, number) pair e.g. ('jenks', 5); see classification
+        scheme, bins = classification.parse_bins(bins)
+        if scheme != 'stddev':
+            if stats is not None:
+                raise ValueError('Only the "stddev" classification scheme can use the summary statistics of a collection')
 
-        steps = 10 
-        ll = 0 # Lower limit
+            return classification.SCHEMES[scheme](series, bins)
 
-        # If there is an odd number of bins...
-        if bins % 2 > 0:
-            ll = 5
+        mean, std = classification.stats(series) if stats is None else stats
+        return classification.breakpoints(mean, std, bins)
 
-        # We'll move the decimal place left by one (1) for these calculations...
-        bps = range(-(bins * 5), 0, steps)
-        bps.extend(range(ll, (bins * 5), steps))
-        bps.append(bins * 5)
-        bps = map(lambda x: (x * 0.1 * series.std()) + series.mean(), bps)
-        bps[0] = -np.inf
-        bps.pop()
-        bps.append(np.inf)
+    def __corners__(self, minx, miny, maxx, maxy):
+        # Returns the five corners of the ring of each of the rectangles with
+        #   the given bounds, as "x,y" strings, counter-clockwise (https://
+        #   developers.google.com/kml/documentation/kmlreference#polygon)
+        bounds = format_unique(np.concatenate((minx, miny, maxx, maxy))).reshape((4, -1))
 
-        assert len(bps) - 1 == bins, 'The correct number of breakpoints could not be calculated'
-        return bps
+        # Permute corner creation from bounds
+        return [bounds[i] + ',' + bounds[j]
+            for i, j in ((0, 3), (0, 1), (2, 1), (2, 3), (0, 3))]
 
     def __description__(self, keys):
         # Remove plurals
@@ -77,7 +118,10 @@ class AbstractGridView:
 
         return desc_tpl
 
-    def __labels__(self, breakpoints, units='', fmt='%.1f'):
+    def __labels__(self, breakpoints, units='', fmt=None):
+        # By default, with as many decimals (at least one) as are needed to
+        #   tell the breakpoints apart
+        fmt = fmt or ('%%.%df' % classification.precision(breakpoints))
         bps = [bp for bp in breakpoints if np.isfinite(bp)]
         labels = [('</= ' + fmt) % bps[0]]
 
@@ -103,31 +147,98 @@ class AbstractGridView:
             KML.Icon(KML.href(os.path.basename(path))),
             KML.size(x=dim[0], y=dim[1], xunits='pixels', yunits='pixels'))
 
+    def __stats__(self, keys):
+        # The (mean, standard deviation) of each field given by the keys over
+        #   the whole collection, so that every frame is classified the same
+        #   way; see classification.collection_stats()
+        return classification.collection_stats(self.mediator,
+            self.collection_name, [k for k in keys if k is not None])
+
     def __style__(self, label):
         return '#%s' % str(label)
 
+    def __render_frames__(self, frames, workers, *args):
+        # Calls __render_frame__() with each (identifier, DataFrame) frame, its
+        #   index and the other arguments; returns their results, in order.
+        #   With more than one worker, the frames are rendered by a pool of
+        #   processes, forked once the cell geometry of each grid is cached,
+        #   so that the view, frames and geometry are inherited, not pickled
+        global _rendering
+        if workers > 1 and len(frames) > 1 and hasattr(os, 'fork'):
+            for ident, df in frames:
+                self.__square_geometry__(np.asarray(df['x'], dtype=np.float64),
+                    np.asarray(df['y'], dtype=np.float64))
+
+            _rendering = (self, frames, args)
+            pool = multiprocessing.Pool(min(workers, len(frames)))
+            try:
+                return pool.map(_render_frame, range(len(frames)), chunksize=1)
+
+            finally:
+                pool.close()
+                pool.join()
+                _rendering = None
+
+        return [self.__render_frame__(i, ident, df, *args)
+            for i, (ident, df) in enumerate(frames)]
+
     def __square_bounds__(self, coords, altitude=None):
-        # For this gridded product, assume square cells; get grid cell resolution
+        # The <coordinates> of a single cell; see __square_rings__()
+        return self.__square_rings__([coords[0]], [coords[1]],
+            None if altitude is None else [altitude])[0]
+
+    def __square_geometry__(self, x, y):
+        # Returns the NaN-free cells and, for those cells, the pieces of the
+        #   <coordinates> of each square cell, formatted once per grid (per
+        #   hash of the centroids and resolution) and reused for each frame
+        #   on the same grid: the 2D rings and the five corners of each ring,
+        #   each followed by a comma, for an altitude to be spliced in
         grid = self.model.grid.get('x')
-
-        # Get the rectangular bounds of the model cell at the grid resolution
-        if not any(map(lambda x: np.isnan(x), coords)):
-            bounds = map(str, Point(coords).buffer(grid, 4).bounds)
-
-        else:
-            return None # Skip NaNs
-
-        # Coordinates should be specified counter-clockwise
-        # (https://developers.google.com/kml/documentation/kmlreference#polygon)
-        # Permute corner creation from bounds; bounds=(minx, miny, maxx, maxy)
-        coords = ((bounds[0], bounds[3]), (bounds[0], bounds[1]),
-            (bounds[2], bounds[1]), (bounds[2], bounds[3]),
-            (bounds[0], bounds[3]))
-
-        if altitude is not None:
-            coords = map(lambda c: (c[0], c[1], str(altitude)), coords)
-
-        return ' '.join(map(lambda c: ','.join(c), coords))
+        half = grid * 0.5 # Grid cells are grid wide
+        key = md5(x.tostring() + y.tostring() + repr(grid)).hexdigest()
+        if key in self.__geometries__:
+            return self.__geometries__[key]
+
+        valid = ~(np.isnan(x) | np.isnan(y)) # Skip NaNs
+        x, y = x[valid], y[valid]
+
+        # Get the rectangular bounds of every cell at the grid resolution (not,
+        #   as before, a buffer of the centroid as wide as the resolution,
+        #   which drew each cell twice as wide as it is)
+        corners = self.__corners__(x - half, y - half, x + half, y + half)
+        geometry = (valid, corners[0] + ' ' + corners[1] + ' ' + corners[2] +
+            ' ' + corners[3] + ' ' + corners[4],
+            [corners[0] + ','] + [' ' + c + ',' for c in corners[1:]])
+
+        # Keep the most recently used grids only
+        self.__geometries__[key] = geometry
+        while len(self.__geometries__) > self.geometry_cache_size:
+            self.__geometries__.popitem(last=False)
+
+        return geometry
+
+    def __square_rings__(self, x, y, altitudes=None, altitude_format=None):
+        # For this gridded product, assume square cells
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        rings = np.empty(len(x), dtype=object) # None for each cell skipped
+        valid, flat, pieces = self.__square_geometry__(x, y)
+        if not valid.any():
+            return rings
+
+        if altitudes is None:
+            rings[valid] = flat
+            return rings
+
+        # Splice the altitude into each corner of the cached rings
+        altitudes = format_unique(np.asarray(altitudes)[valid], altitude_format)
+        result = pieces[0] + altitudes
+        for piece in pieces[1:]:
+            result = result + piece + altitudes
+
+        rings[valid] = result
+        return rings
 
     def __tour__(self):
         # Define a variable for the Google Extensions namespace URL string
@@ -203,7 +314,34 @@ class AbstractGridView:
         return tour
 
     def __query__(self, query_object):
-        return self.mediator.load_from_db(self.collection_name, query_object)
+        return self.mediator.load(self.collection_name, query_object)
+
+    def __stream__(self, query_object):
+        # Generates the (identifier, DataFrame) frames in time order, one at
+        #   a time if the mediator can (e.g. the Grid3DMediator)
+        if hasattr(self.mediator, 'iter_frames'):
+            return self.mediator.iter_frames(self.collection_name, query_object)
+
+        return iter(sorted(self.__query__(query_object).items()))
+
+    def __write__(self, path, preamble, folder_name, placemarks):
+        # Writes a <Document> of the preamble elements (e.g. styles, the
+        #   legend) and a <Folder> of the placemarks, writing each placemark
+        #   as it is generated, so that the document is never in memory as a
+        #   whole; the output is what etree.tostring() of the <Document> gives
+        marker = etree.Comment('placemarks')
+        head, tail = etree.tostring(KML.Document(*(list(preamble) + [
+            KML.Folder(KML.name(folder_name), marker)
+        ]))).split(etree.tostring(marker))
+
+        with open(path, 'wb') as stream:
+            stream.write(head)
+
+            # The namespaces were already declared by the <Document>
+            for placemark in placemarks:
+                stream.write(etree.tostring(placemark).replace(NS_DECLARATIONS, '', 1))
+
+            stream.write(tail)
 
 
 class AbstractScoreView(AbstractGridView):
@@ -249,11 +387,11 @@ class AbstractScoreView(AbstractGridView):
 
         return ('#%s%d' % (color, score)).lower()
 
-    def __scores__(self, series):
-        # Calculates z scores for a given series
-        mean = series.mean()
-        std = series.std()
-        return series.apply(lambda x: x - mean).apply(lambda x: x * (1/std))
+    def __scores__(self, series, stats=None):
+        # Calculates z scores for a given series, about its mean or, if
+        #   given, the (mean, standard deviation)
+        mean, std = classification.stats(series) if stats is None else stats
+        return classification.scores(series, mean, std)
 
 
 class KMZWrapper:
@@ -285,8 +423,15 @@ class KMZWrapper:
 class Legend:
     '''
     A legend for a classification scale based on colored parcels. The entries
-    are drawn as square cells in a vertical list.
+    are drawn as square cells in a vertical list. A legend is only drawn if
+    the same legend (entries, size and style) has not already been drawn in
+    its directory; otherwise, that image is reused (see cache_info()). The
+    cache is kept per process, e.g. by each worker that renders frames.
     '''
+    contents = dict() # The legend (key) that each file path was drawn for
+    hits = 0 # The number of legends reused rather than drawn
+    misses = 0 # The number of legends drawn
+    sources = dict() # The file path that each legend (key) was drawn to
 
     def __init__(self, size, entries, path='.', scale_name='legend'):
         self.bg_color = '#000000'
@@ -298,12 +443,10 @@ class Legend:
         # Unzip a sequence of (color, label) tuples
         self.colors, self.labels = zip(*entries)
         self.dpi = 92.0 # Should be float
+        self.size = size
         self.width = self.dpi * size[0] # e.g. 2.0 inches
         self.height = self.dpi * size[1] # e.g. 5.0 inches
-        self.figure, self.axis = plt.subplots()
         self.file_path = os.path.join(path, '%s.png' % scale_name)
-        self.figure.set_tight_layout(False)
-        self.figure.set_size_inches(*size)
 
         # Reverse the labels and color order; the drawing process is backwards
         #   from intuition
@@ -314,16 +457,57 @@ class Legend:
         warnings.filterwarnings('ignore', r'.*tight_layout.*',
             UserWarning, r'.*figure.*')
 
+    @classmethod
+    def cache_info(cls):
+        '''
+        Returns the number of legends reused (hits) and drawn (misses) by
+        this process and the fraction that were reused (hit_rate). Only the
+        legends of frames rendered in this process are counted, i.e. not
+        those rendered by a pool of workers (render() with workers > 1).
+        '''
+        total = cls.hits + cls.misses
+        return {
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_rate': (cls.hits / float(total)) if total else 0.0
+        }
+
     def __label__(self, xy, text, x_offset=0):
         # Calls a text label on the plot
         plt.text(xy[0] - (x_offset / self.dpi), xy[1], text, ha='left', va='bottom',
             family='sans-serif', size=13, color='#ffffff')
 
+    def __reuse__(self, key):
+        # Reuses the image of the same legend, if one was drawn in this
+        #   directory (and not since overwritten); returns True if it was
+        if Legend.contents.get(self.file_path) == key and os.path.exists(self.file_path):
+            return True
+
+        source = Legend.sources.get(key)
+        if source is None or Legend.contents.get(source) != key or not os.path.exists(source):
+            return False
+
+        shutil.copyfile(source, self.file_path)
+        Legend.contents[self.file_path] = key
+        return True
+
     def render(self, patch_size=0.5, alpha=1.0, x_offset=100):
         '''Draws the legend graphic and saves it to a file.'''
+        key = (os.path.dirname(os.path.abspath(self.file_path)), self.colors,
+            self.labels, tuple(self.size), self.dpi, patch_size, alpha, x_offset)
+
+        if self.__reuse__(key):
+            Legend.hits += 1
+            return self.file_path
+
+        Legend.misses += 1
         n = len(self.colors)
         s = patch_size
 
+        self.figure, self.axis = plt.subplots()
+        self.figure.set_tight_layout(False)
+        self.figure.set_size_inches(*self.size)
+
         # This offset is transformed to "data" coordinates (inches)
         left_offset = (-s * 1.5) - (x_offset / self.dpi)
 
@@ -361,6 +545,11 @@ class Legend:
         plt.savefig(self.file_path, facecolor=self.bg_color, dpi=self.dpi,
             pad_inches=0)
 
+        # Close the figure; otherwise pyplot keeps every legend ever drawn
+        plt.close(self.figure)
+        Legend.contents[self.file_path] = key
+        Legend.sources[key] = self.file_path
+
         return self.file_path
 
 
@@ -369,8 +558,72 @@ class StaticKMLView(AbstractGridView):
     Writes out KML files from spatio-temporal data provided by a Mediator.
     '''
 
+    def __placemarks__(self, df, keys, desc_tpl, vscale, vpow):
+        # Generates a <Placemark> for each row (grid cell) of the DataFrame
+        f1, f2 = keys
+        if f2 is not None:
+            rings = self.__square_rings__(df['x'], df['y'],
+                np.power(df[f2].values * vscale, vpow)) # Altitude
+
+        else:
+            rings = self.__square_rings__(df['x'], df['y'])
+
+        for coords, (j, series) in itertools.izip(rings, df.iterrows()):
+            if coords is None:
+                continue
+
+            yield KML.Placemark(
+                KML.description(desc_tpl.format(**dict(series))),
+                KML.styleUrl('#%s' % series['bin']),
+                KML.Polygon(
+                    KML.extrude(1),
+                    KML.altitudeMode('absolute'),
+                    KML.outerBoundaryIs(
+                        KML.LinearRing(
+                            KML.coordinates(*coords)))))
+
+    def __render_frame__(self, i, ident, df, output_path, keys, desc_tpl,
+            scale, bins, color, vscale, vpow, stats):
+        # Writes the KML file and the legend of one frame; returns their paths
+        f1, f2 = keys
+
+        # Get breakpoints, labels based on the requested number of bins
+        breakpoints = self.__breakpoints__(df[f1], bins, stats.get(f1))
+        labels = self.__labels__(breakpoints, self.field_units[f1])
+
+        # Bin each value based on the breakpoints; format the labels (NaN
+        #   for no value)
+        classes = classification.classify(df[f1], breakpoints)
+        df['bin'] = np.where(classes >= 0,
+            np.array(labels, dtype=object)[classes], np.nan)
+
+        if not isinstance(scale, DivergingColors):
+            labels = labels[::-1] # Reverse
+
+        # Generate a legend graphic and get the <ScreenOverlay> element for such a graphic
+        legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
+            output_path, ident)
+
+        preamble = list(scale.kml_styles(labels, outlines=False, alpha=self.alpha))
+        preamble.append(KML.name(self.collection_name))
+
+        # Add the legends; the <Folder> element with <Placemarks> follows
+        preamble.extend([
+            self.__tour__(),
+            # Calculate the legend image dimensions based on its size in inches and the DPI
+            self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
+                color, legend.file_path)
+        ])
+
+        output_name = os.path.join(output_path, self.filename_pattern % (ident, i))
+        self.__write__(output_name, preamble, ident,
+            self.__placemarks__(df, keys, desc_tpl, vscale, vpow))
+
+        return (output_name, legend.render(x_offset=150))
+
     def render(self, query, output_path, keys=('values', 'errors'),
-            bins=3, color='BrBG11', vscale=1000, vpow=2, cutoffs=(None, 1.2)):
+            bins=3, color='BrBG11', vscale=1000, vpow=2, cutoffs=(None, 1.2),
+            workers=1, global_stats=False):
         '''
         Generates a KML view of gridded, 3D data using up to two fields,
         given by the dictionary keys, in the connected data e.g. the first
@@ -378,91 +631,345 @@ class StaticKMLView(AbstractGridView):
         KML Polygon extrusion height. Assumes that each grid cell has a
         single longitude-latitude pair describing its centroid. The keys
         argument is a sequence of strings representing field names to use for
-        these symbols, in order: the polygon style, the altitude.
+        these symbols, in order: the polygon style, the altitude. The bins
+        are a number of classes one standard deviation wide or a (scheme,
+        number) pair e.g. ('quantile', 5); see classification.SCHEMES. The
+        placemarks are written as they are generated. With more than one
+        worker, the frames are rendered in parallel; see __render_frames__().
+        Each frame is binned about its own mean or, with global_stats, that
+        of the whole collection (see __stats__()).
         '''
-        file_paths = [] # Remember all files that may need to be bundled in KMZ
         scale = self.colors.get(color)
 
         if not os.path.exists(output_path):
             raise ValueError('The specified output_path does not exist or cannot be read')
 
-        if bins > 9:
+        if classification.parse_bins(bins)[1] > 9:
             raise ValueError('Cannot have more than 9 bins in sequential scales')
 
-        # Get field names
-        f1, f2 = keys
-
         # Get the <description> element template
         desc_tpl = self.__description__(keys)
+        stats = self.__stats__(keys[:1]) if global_stats else {}
 
         # Execute the query
         dfs = self.__query__(query)
 
-        # Parse out the identifier and the DataFrame
-        i = 0 # Iterate through the returned DataFrames
-        for ident, df in dfs.items():
-            placemarks = [] # Initial container
+        # Remember all files that may need to be bundled in KMZ
+        return self.__render_frames__(dfs.items(), workers, output_path, keys,
+            desc_tpl, scale, bins, color, vscale, vpow, stats)
 
-            # Get breakpoints, labels based on the requested number of bins
-            breakpoints = self.__breakpoints__(df[f1], bins)
-            labels = self.__labels__(breakpoints, self.field_units[f1])
 
-            # Bin each value based on the breakpoints; format the labels
-            df['bin'] = pd.cut(df[f1], breakpoints, labels=labels)
+class TiledKMLView(AbstractGridView):
+    '''
+    Writes out KML files from gridded, spatio-temporal data provided by a
+    Mediator where each frame is a quadtree of tiles (a "super-overlay"):
+    each tile is a KML document with a <Region> and links (<NetworkLink>) to
+    the tiles in each quarter of it, so that Google Earth fetches and draws
+    only the tiles in view at a level of detail suited to the view. Coarse
+    tiles draw the mean of blocks of grid cells; only the finest tiles draw
+    the grid cells themselves.
+    '''
+    lod_pixels = 128 # Size on screen (in pixels) at which a tile is drawn
+    tile_filename_pattern = '%s_%d_%s.kml' # Must have %s, %d, %s format strings in name
+    tile_size = 32 # Number of grid cells (or blocks of them) across a tile
+
+    def __placemarks__(self, x, y, values, corners, labels, desc_tpl, key):
+        # Generates a <Placemark> for each cell (or block of cells) with a value
+        rings = corners[0] + ' ' + corners[1] + ' ' + corners[2] + ' ' + \
+            corners[3] + ' ' + corners[4]
+
+        for i in np.flatnonzero(~np.isnan(values)):
+            yield KML.Placemark(
+                KML.description(desc_tpl.format(**{
+                    'x': x[i], 'y': y[i], key: values[i]
+                })),
+                KML.styleUrl('#%s' % labels[i]),
+                KML.Polygon(
+                    KML.outerBoundaryIs(
+                        KML.LinearRing(
+                            KML.coordinates(rings[i])))))
+
+    def __region__(self, bounds, extent, min_lod, max_lod):
+        # A <Region> of the bounds (west, south, east, north), within the
+        #   extent of the data
+        west, south, east, north = bounds
+        return KML.Region(
+            KML.LatLonAltBox(
+                KML.north(repr(min(north, extent[3]))),
+                KML.south(repr(max(south, extent[1]))),
+                KML.east(repr(min(east, extent[2]))),
+                KML.west(repr(max(west, extent[0])))),
+            KML.Lod(
+                KML.minLodPixels(min_lod),
+                KML.maxLodPixels(max_lod)))
+
+    def __render_frame__(self, i, ident, df, output_path, key, desc_tpl,
+            scale, bins, color, stats):
+        # Writes the KML file of each tile and the legend of one frame; the
+        #   tiles are written one at a time, depth first, so that only the
+        #   cells (or blocks) of one tile are formatted at a time; returns
+        #   the paths of the top tile and the legend
+        size = float(self.model.grid.get('x')) # Grid cells are this wide
+        x = np.asarray(df['x'], dtype=np.float64)
+        y = np.asarray(df['y'], dtype=np.float64)
+        values = np.asarray(df[key], dtype=np.float64)
+
+        # Get breakpoints, labels based on the requested number of bins
+        breakpoints = self.__breakpoints__(df[key], bins, stats.get(key))
+        labels = self.__labels__(breakpoints, self.field_units[key])
+
+        # Bin each value based on the breakpoints
+        names = np.array(labels, dtype=object)
+        classes = lambda v: names[classification.classify(v, breakpoints)]
+
+        if not isinstance(scale, DivergingColors):
+            labels = labels[::-1] # Reverse
+
+        legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
+            output_path, ident)
+        styles = list(scale.kml_styles(labels, outlines=False, alpha=self.alpha))
+
+        # The top tile is a square, a power of 2 number of tiles wide, so that
+        #   each tile (and block of cells) is aligned with the grid cells
+        valid = ~(np.isnan(x) | np.isnan(y))
+        if not valid.any():
+            raise ValueError('Cannot tile a frame without any grid cells')
+
+        extent = (x[valid].min() - size * 0.5, y[valid].min() - size * 0.5,
+            x[valid].max() + size * 0.5, y[valid].max() + size * 0.5)
+        depth = int(math.ceil(math.log(max(1.0, max(extent[2] - extent[0],
+            extent[3] - extent[1]) / (size * self.tile_size)), 2)))
+
+        stack = [('', 0, (extent[0], extent[1]), np.flatnonzero(valid))]
+        while len(stack) > 0:
+            quadkey, level, (west, south), cells = stack.pop()
+            width = size * self.tile_size * 2 ** (depth - level)
+            bounds = (west, south, west + width, south + width)
+
+            # Find the quarters of this tile that have any grid cells
+            children = []
+            if level < depth:
+                half = width * 0.5
+                quarter = ((x[cells] >= west + half).astype(np.intp) +
+                    (y[cells] >= south + half).astype(np.intp) * 2)
+                for q in range(4):
+                    members = cells[quarter == q]
+                    if len(members) > 0:
+                        children.append((quadkey + str(q), level + 1,
+                            (west + half * (q % 2), south + half * (q // 2)),
+                            members))
+
+            if level < depth:
+                # Average the values in blocks of (block x block) grid cells
+                block = size * 2 ** (depth - level)
+                col = np.floor((x[cells] - west) / block).astype(np.intp)
+                row = np.floor((y[cells] - south) / block).astype(np.intp)
+                ids = row * self.tile_size + col
+                finite = ~np.isnan(values[cells])
+                counts = np.bincount(ids[finite], minlength=self.tile_size ** 2)
+                totals = np.bincount(ids[finite], values[cells][finite],
+                    minlength=self.tile_size ** 2)
+
+                ids = np.flatnonzero(counts)
+                vx = west + (ids % self.tile_size) * block
+                vy = south + (ids // self.tile_size) * block
+                vv = totals[ids] / counts[ids]
+                corners = self.__corners__(np.maximum(vx, extent[0]),
+                    np.maximum(vy, extent[1]), np.minimum(vx + block, extent[2]),
+                    np.minimum(vy + block, extent[3]))
+                vx, vy = vx + block * 0.5, vy + block * 0.5
 
-            if not isinstance(scale, DivergingColors):
-                labels = labels[::-1] # Reverse
+            else:
+                vx, vy, vv = x[cells], y[cells], values[cells]
+                corners = self.__corners__(vx - size * 0.5, vy - size * 0.5,
+                    vx + size * 0.5, vy + size * 0.5)
+
+            # The top tile is drawn from any distance; a tile is hidden once
+            #   its quarters are drawn in its place
+            preamble = [KML.name(self.collection_name),
+                self.__region__(bounds, extent, 0 if level == 0 else self.lod_pixels,
+                    2 * self.lod_pixels if children else -1)]
+            preamble.extend(styles)
+
+            if level == 0:
+                # Calculate the legend image dimensions based on its size in inches and the DPI
+                preamble.append(self.__legend__(map(lambda x: x * legend.dpi,
+                    self.legend_size), color, legend.file_path))
+
+            for child in children:
+                preamble.append(KML.NetworkLink(
+                    KML.name(child[0]),
+                    self.__region__((child[2][0], child[2][1],
+                        child[2][0] + width * 0.5, child[2][1] + width * 0.5),
+                        extent, self.lod_pixels, -1),
+                    KML.Link(
+                        KML.href(self.tile_filename_pattern % (ident, i, child[0])),
+                        KML.viewRefreshMode('onRegion'))))
+
+            if level == 0:
+                path = os.path.join(output_path, self.filename_pattern % (ident, i))
 
-            # Generate a legend graphic and get the <ScreenOverlay> element for such a graphic
-            legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
-                output_path, ident)
+            else:
+                path = os.path.join(output_path,
+                    self.tile_filename_pattern % (ident, i, quadkey))
 
-            # Iterate through the rows of the Data Frame
-            for j, series in df.iterrows():
+            self.__write__(path, preamble, ident, self.__placemarks__(vx, vy,
+                vv, corners, classes(vv), desc_tpl, key))
 
-                if f2 is not None:
-                    coords = self.__square_bounds__((series['x'], series['y']),
-                        math.pow(series[f2] * vscale, vpow)) # Altitude
+            # Visit the quarters in order (0, 1, 2, 3)
+            stack.extend(reversed(children))
 
-                else:
-                    coords = self.__square_bounds__((series['x'], series['y']))
+        return (os.path.join(output_path, self.filename_pattern % (ident, i)),
+            legend.render(x_offset=150))
 
-                if coords is None:
-                    continue
+    def render(self, query, output_path, key='values', bins=3, color='BuGn3',
+            workers=1, global_stats=False):
+        '''
+        Generates a tiled KML view of gridded, 3D data where the field given
+        by the key, binned into classes as in the StaticKMLView, encodes the
+        color of each grid cell (or, in coarse tiles, of each block of grid
+        cells). Assumes that each grid cell has a single longitude-latitude
+        pair describing its centroid, on a regular grid. The tiles of each
+        frame are written to the output_path; returns a (top tile, legend
+        file) pair for each frame. With more than one worker, the frames are
+        rendered in parallel; see __render_frames__(). Each frame is binned
+        about its own mean or, with global_stats, that of the whole
+        collection (see __stats__()).
+        '''
+        scale = self.colors.get(color)
 
-                placemarks.append(KML.Placemark(
-                    KML.description(desc_tpl.format(**dict(series))),
-                    KML.styleUrl('#%s' % series['bin']),
-                    KML.Polygon(
-                        KML.extrude(1),
-                        KML.altitudeMode('absolute'),
-                        KML.outerBoundaryIs(
-                            KML.LinearRing(
-                                KML.coordinates(*coords))))))
+        if not os.path.exists(output_path):
+            raise ValueError('The specified output_path does not exist or cannot be read')
 
-            preamble = list(scale.kml_styles(labels, outlines=False, alpha=self.alpha))
-            preamble.append(KML.name(self.collection_name))
+        if classification.parse_bins(bins)[1] > 9:
+            raise ValueError('Cannot have more than 9 bins in sequential scales')
 
-            # Add the legends and the <Folder> element with <Placemarks>
-            preamble.extend([
-                self.__tour__(),
-                # Calculate the legend image dimensions based on its size in inches and the DPI
-                self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
-                    color, legend.file_path),
-                KML.Folder(KML.name(ident), *placemarks)
-            ])
+        # Get the <description> element template
+        desc_tpl = self.__description__((key,))
+        stats = self.__stats__([key]) if global_stats else {}
 
-            doc = KML.Document(*preamble)
+        # Execute the query
+        dfs = self.__query__(query)
 
-            output_name = os.path.join(output_path, self.filename_pattern % (ident, i))
-            with open(output_name, 'wb') as stream:
-                stream.write(etree.tostring(doc))
+        return self.__render_frames__(dfs.items(), workers, output_path, key,
+            desc_tpl, scale, bins, color, stats)
 
-            file_paths.append((output_name, legend.render(x_offset=150)))
 
-            i += 1
+class AnimatedKMLView(AbstractGridView):
+    '''
+    Writes out a single, time-animated KML file from gridded, spatio-temporal
+    data provided by a Mediator. Each cell has a <Placemark> for each run of
+    consecutive frames in which its value is in the same class, with a
+    <TimeSpan> from the first frame of the run to the frame in which it
+    changes, so that the file grows with the number of changes of class
+    rather than the number of cells times the number of frames.
+    '''
+    filename_pattern = '%s.kml' # Must have a %s format string in name
+
+    def __placemarks__(self, frames, key, breakpoints, labels):
+        # Generates a <Placemark> for each run of a cell's class, as soon as
+        #   the run ends (or, for the runs that last until the last frame,
+        #   at the end), reading one frame at a time
+        ident, df = frames.next()
+        x = np.asarray(df['x'], dtype=np.float64)
+        y = np.asarray(df['y'], dtype=np.float64)
+        rings = self.__square_rings__(x, y)
+        names = np.array(labels, dtype=object)
+
+        def placemark(j, begin, end=None):
+            span = KML.TimeSpan(KML.begin(begin))
+            if end is not None:
+                span.append(KML.end(end))
+
+            return KML.Placemark(span,
+                KML.styleUrl('#%s' % names[current[j]]),
+                KML.Polygon(
+                    KML.outerBoundaryIs(
+                        KML.LinearRing(
+                            KML.coordinates(rings[j])))))
+
+        times = [ident] # The first frame of each run is an index to these
+        current = classification.classify(df[key], breakpoints)
+        starts = np.zeros(len(current), dtype=np.intp)
+        valid = np.not_equal(rings, None) # Cells without NaN coordinates
+        drawn = (current >= 0) & valid
+
+        for ident, df in frames:
+            if (np.asarray(df['x'], dtype=np.float64).tostring() != x.tostring()
+                    or np.asarray(df['y'], dtype=np.float64).tostring() != y.tostring()):
+                raise ValueError('Every frame must have the same grid cells, in the same order')
+
+            classes = classification.classify(df[key], breakpoints)
+            changed = np.flatnonzero(classes != current)
+            for j in changed[drawn[changed]]:
+                yield placemark(j, times[starts[j]], ident)
+
+            current[changed] = classes[changed]
+            starts[changed] = len(times)
+            drawn = (current >= 0) & valid
+            times.append(ident)
+
+        for j in np.flatnonzero(drawn):
+            yield placemark(j, times[starts[j]])
+
+    def render(self, query, output_path, key='values', bins=3, color='BuGn3',
+            breakpoints=None, global_stats=False):
+        '''
+        Generates a single, time-animated KML view of gridded, 3D data where
+        the field given by the key, binned into classes as in the
+        StaticKMLView, encodes the color of each grid cell. Assumes that
+        each grid cell has a single longitude-latitude pair describing its
+        centroid and that every frame has the same grid cells. The frames
+        are read (see __stream__()) and written one at a time. The same
+        classes are used for every frame: those of the given breakpoints, of
+        the whole collection (with global_stats; see __stats__()) or, by
+        default, of the first frame. Returns the (KML file, legend file)
+        pair in a list.
+        '''
+        scale = self.colors.get(color)
 
-        return file_paths
+        if not os.path.exists(output_path):
+            raise ValueError('The specified output_path does not exist or cannot be read')
+
+        if classification.parse_bins(bins)[1] > 9:
+            raise ValueError('Cannot have more than 9 bins in sequential scales')
+
+        frames = self.__stream__(query)
+        try:
+            first = frames.next()
+
+        except StopIteration:
+            raise ValueError('No frames matched the query')
+
+        # Get breakpoints, labels based on the requested number of bins
+        if breakpoints is None:
+            breakpoints = self.__breakpoints__(first[1][key], bins,
+                self.__stats__([key])[key] if global_stats else None)
+
+        labels = self.__labels__(breakpoints, self.field_units[key])
+        names = labels
+
+        if not isinstance(scale, DivergingColors):
+            labels = labels[::-1] # Reverse
+
+        legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
+            output_path, self.collection_name)
+
+        preamble = list(scale.kml_styles(labels, outlines=False, alpha=self.alpha))
+        preamble.extend([
+            KML.name(self.collection_name),
+            # Calculate the legend image dimensions based on its size in inches and the DPI
+            self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
+                color, legend.file_path)
+        ])
+
+        output_name = os.path.join(output_path,
+            self.filename_pattern % self.collection_name)
+        self.__write__(output_name, preamble, self.collection_name,
+            self.__placemarks__(itertools.chain([first], frames), key,
+                breakpoints, names))
+
+        return [(output_name, legend.render(x_offset=150))]
 
 
 class ScoredKMLView(AbstractScoreView):
@@ -493,89 +1000,220 @@ class ScoredKMLView(AbstractScoreView):
 
         return elements
 
+    def __placemarks__(self, df, fields, desc_tpl, color, vscale):
+        # Generates a <Placemark> for each row (grid cell) of the DataFrame
+        f1, f2 = fields
+
+        # Altitudes are formatted as str() formats a NumPy float
+        rings = self.__square_rings__(df['x'], df['y'],
+            df[f2].values * vscale, str) # Altitude
+
+        for coords, (j, series) in itertools.izip(rings, df.iterrows()):
+            if coords is None:
+                continue # Skip NaNs
+
+            yield KML.Placemark(
+                KML.description(desc_tpl.format(**dict(series))),
+                KML.styleUrl(self.__style__(series[f1], color)),
+                KML.Polygon(
+                    KML.extrude(1),
+                    KML.altitudeMode('absolute'),
+                    KML.outerBoundaryIs(
+                        KML.LinearRing(
+                            KML.coordinates(*coords)))))
+
+    def __render_frame__(self, i, ident, df, output_path, keys, desc_tpl,
+            scale, color, vscale, legend_frame, stats):
+        # Writes the KML file of one frame and, if it is the legend_frame,
+        #   the legend they share; returns the path of the legend
+        f1, f2 = map(lambda x: 'z%s' % x, keys)
+
+        # Calculate z scores for the values; the extrusion height is at least 1
+        z1 = self.__scores__(df[keys[0]], stats.get(keys[0]))
+        z2 = self.__scores__(df[keys[1]], stats.get(keys[1]))
+        with np.errstate(invalid='ignore'):
+            df[f1] = s1 = np.ceil(z1)
+            df[f2] = np.where(z2 > 0, np.ceil(z2) + 1, 1)
+
+        # Get z score labels
+        labels = self.__labels__(scale.score_length, len(pd.unique(s1)) > len(scale))
+
+        if not isinstance(scale, DivergingColors):
+            labels = labels[::-1] # Reverse
+
+        # Generate a legend graphic and get the <ScreenOverlay> element for such a graphic
+        legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
+            output_path, color)
+
+        preamble = list(scale.kml_styles(outlines=False, alpha=self.alpha))
+        preamble.append(KML.name(self.collection_name))
+
+        # Add the legends; the <Folder> element with <Placemarks> follows
+        preamble.extend(self.__legend_vertical__(vscale=vscale))
+        preamble.append(
+            # Calculate the legend image dimensions based on its size in inches and the DPI
+            self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
+                color, legend.file_path))
+
+        self.__write__(os.path.join(output_path, self.filename_pattern % (ident, i)),
+            preamble, ident, self.__placemarks__(df, (f1, f2), desc_tpl, color, vscale))
+
+        # Every frame's legend has the same path; only the last one is kept
+        if i == legend_frame:
+            return legend.render()
+
+        return legend.file_path
+
     def render(self, query, output_path, keys=('values', 'errors'),
-            color='dBrBG11', vscale=100000):
+            color='dBrBG11', vscale=100000, workers=1, global_stats=False):
         '''
         Generates a KML view of gridded, 3D data with standard scores (z scores)
         using up to two fields, given by the dictionary keys, in the connected 
         data e.g. the first field will be used to encode color and the second
         field to encode the KML Polygon extrusion height. Assumes that each grid
-        cell has a single longitude-latitude pair describing its centroid.
+        cell has a single longitude-latitude pair describing its centroid. The
+        placemarks are written as they are generated. With more than one
+        worker, the frames are rendered in parallel; see __render_frames__().
+        The scores are about the mean of each frame or, with global_stats,
+        that of the whole collection (see __stats__()).
         '''
-        file_paths = [] # Remember all files that may need to be bundled in KMZ
         scale = self.colors.get(color)
 
         if not os.path.exists(output_path):
             raise ValueError('The specified output_path does not exist or cannot be read')
 
-        # Get field names
-        f1, f2 = map(lambda x: 'z%s' % x, keys)
-
         # Get the <description> element template
         desc_tpl = self.__description__(keys)
+        stats = self.__stats__(keys) if global_stats else {}
 
         # Execute the query
         dfs = self.__query__(query)
 
-        # Parse out the identifier and the DataFrame
-        i = 0 # Iterate through the returned DataFrames
-        for ident, df in dfs.items():
-            placemarks = [] # Initial container
-
-            # Calculate z scores for the values
-            df[f1] = s1 = self.__scores__(df[keys[0]]).apply(math.ceil)
-            df[f2] = s2 = self.__scores__(df[keys[1]]).apply(lambda x: math.ceil(x) + 1 if x > 0 else 1)
-
-            # Get z score labels
-            labels = self.__labels__(scale.score_length, len(s1.unique()) > len(scale))
-
-            if not isinstance(scale, DivergingColors):
-                labels = labels[::-1] # Reverse
-
-            # Generate a legend graphic and get the <ScreenOverlay> element for such a graphic
-            legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
-                output_path, color)
-
-            # Iterate through the rows of the Data Frame
-            for j, series in df.iterrows():
-
-                coords = self.__square_bounds__((series['x'], series['y']),
-                    (series[f2] * vscale)) # Altitude
+        # Remember all files that may need to be bundled in KMZ
+        file_paths = self.__render_frames__(dfs.items(), workers, output_path,
+            keys, desc_tpl, scale, color, vscale, len(dfs) - 1, stats)
+        file_paths.insert(0, output_path)
 
-                placemarks.append(KML.Placemark(
-                    KML.description(desc_tpl.format(**dict(series))),
-                    KML.styleUrl(self.__style__(series[f1], color)),
-                    KML.Polygon(
-                        KML.extrude(1),
-                        KML.altitudeMode('absolute'),
-                        KML.outerBoundaryIs(
-                            KML.LinearRing(
-                                KML.coordinates(*coords))))))
+        return file_paths
 
-            preamble = list(scale.kml_styles(outlines=False, alpha=self.alpha))
-            preamble.append(KML.name(self.collection_name))
 
-            # Add the legends and the <Folder> element with <Placemarks>
-            preamble.extend(self.__legend_vertical__(vscale=vscale))
-            preamble.extend([
-                # Calculate the legend image dimensions based on its size in inches and the DPI
-                self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
-                    color, legend.file_path),
-                KML.Folder(KML.name(ident), *placemarks)
-            ])
+class RasterKMLView(AbstractGridView):
+    '''
+    Writes out KMZ files from gridded, spatio-temporal data provided by a
+    Mediator, where each frame is a single image (a <GroundOverlay>) of the
+    grid instead of a <Placemark> for each grid cell.
+    '''
 
-            doc = KML.Document(*preamble)
+    def __raster__(self, x, y, classes, lut):
+        # Returns the RGBA image (rows from north to south) of the grid cells,
+        #   one pixel per cell, colored by looking up the class of each cell
+        #   (0 for no data) in the lookup table, and the image's bounds
+        #   (north, south, east, west); assumes a regular grid, with the
+        #   resolution of the model, of cells given by their centroids
+        dx = float(self.model.grid.get('x'))
+        dy = float(self.model.grid.get('y', dx))
+
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x, y, classes = x[valid], y[valid], classes[valid]
+        if len(x) == 0:
+            raise ValueError('Cannot rasterize a frame without any grid cells')
+
+        west, north = x.min(), y.max()
+        cols = np.round((x - west) / dx).astype(np.intp)
+        rows = np.round((north - y) / dy).astype(np.intp)
+
+        image = np.zeros((rows.max() + 1, cols.max() + 1), dtype=np.intp)
+        image[rows, cols] = classes
+
+        return (lut[image], (north + dy * 0.5, north - dy * (image.shape[0] - 0.5),
+            west + dx * (image.shape[1] - 0.5), west - dx * 0.5))
+
+    def __render_frame__(self, i, ident, df, output_path, key, scale, bins,
+            color, stats):
+        # Writes the KMZ file (the KML document and the image) and the
+        #   legend of one frame; returns their paths
+        breakpoints = self.__breakpoints__(df[key], bins, stats.get(key))
+        labels = self.__labels__(breakpoints, self.field_units[key])
+
+        # The colors of each bin, in order, with the same pairing of colors
+        #   and bins as the StaticKMLView; the first row is for no data
+        colors = scale.hex_colors()[:(len(breakpoints) - 1)]
+        if not isinstance(scale, DivergingColors):
+            labels = labels[::-1] # Reverse
+            colors = colors[::-1]
+
+        lut = np.zeros((len(colors) + 1, 4), dtype=np.uint8)
+        lut[1:, :3] = [[int(c[j:j + 2], 16) for j in (1, 3, 5)] for c in colors]
+        lut[1:, 3] = int(self.alpha * 255)
+
+        # Bin each value based on the breakpoints
+        classes = classification.classify(df[key], breakpoints) + 1
+
+        rgba, (north, south, east, west) = self.__raster__(
+            np.asarray(df['x'], dtype=np.float64),
+            np.asarray(df['y'], dtype=np.float64), classes, lut)
+
+        legend = Legend(self.legend_size, zip(scale.hex_colors(), labels),
+            output_path, ident)
+
+        kml_name = self.filename_pattern % (ident, i)
+        image_name = '%s.png' % os.path.splitext(kml_name)[0]
+        document = KML.kml(KML.Document(
+            KML.name(self.collection_name),
+            # Calculate the legend image dimensions based on its size in inches and the DPI
+            self.__legend__(map(lambda x: x * legend.dpi, self.legend_size),
+                color, legend.file_path),
+            KML.GroundOverlay(
+                KML.name(ident),
+                KML.Icon(KML.href(image_name)),
+                KML.LatLonBox(
+                    KML.north(repr(north)),
+                    KML.south(repr(south)),
+                    KML.east(repr(east)),
+                    KML.west(repr(west))))))
+
+        image = io.BytesIO()
+        mpimage.imsave(image, rgba, format='png')
+
+        # The KML document must be the first file in the archive
+        output_name = os.path.join(output_path,
+            '%s.kmz' % os.path.splitext(kml_name)[0])
+        legend_path = legend.render(x_offset=150)
+        with ZipFile(output_name, 'w', ZIP_DEFLATED) as archive:
+            archive.writestr(kml_name, etree.tostring(document))
+            archive.writestr(image_name, image.getvalue())
+            archive.write(legend_path, os.path.basename(legend_path))
+
+        return (output_name, legend_path)
+
+    def render(self, query, output_path, key='values', bins=3, color='BuGn3',
+            workers=1, global_stats=False):
+        '''
+        Generates a KMZ file for each frame of gridded, 3D data where the
+        field given by the key, binned into classes as in the StaticKMLView,
+        is drawn as an image of the grid (one pixel per grid cell) that
+        is laid over the ground. Assumes that each grid cell has a single
+        longitude-latitude pair describing its centroid, on a regular grid.
+        Returns a (KMZ file, legend file) pair for each frame. With more
+        than one worker, the frames are rendered in parallel; see
+        __render_frames__(). Each frame is binned about its own mean or,
+        with global_stats, that of the whole collection (see __stats__()).
+        '''
+        scale = self.colors.get(color)
 
-            with open(os.path.join(output_path, self.filename_pattern % (ident, i)), 'wb') as stream:
-                stream.write(etree.tostring(doc))
+        if not os.path.exists(output_path):
+            raise ValueError('The specified output_path does not exist or cannot be read')
 
-            file_paths.append(legend.render())
+        if classification.parse_bins(bins)[1] > 9:
+            raise ValueError('Cannot have more than 9 bins in sequential scales')
 
-            i += 1
+        stats = self.__stats__([key]) if global_stats else {}
 
-        file_paths.insert(0, output_path)
+        # Execute the query
+        dfs = self.__query__(query)
 
-        return file_paths
+        return self.__render_frames__(dfs.items(), workers, output_path, key,
+            scale, bins, color, stats)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+'''
+Benchmarks for extracting data from the test files; run as a script, e.g.:
+
+    python benchmarks.py
+
+Each benchmark compares the current implementation against a "legacy"
+subclass that restores the previous, per-value implementation.
+'''
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy as np
+import pandas as pd
+import scipy.io
+from fluxpy import __path__ as fluxpy_module_path
+from fluxpy.models import KrigedXCO2Matrix, SpatioTemporalMatrix, XCO2Matrix
+
+PATH = os.path.join(fluxpy_module_path[0], 'tests')
+
+def legacy_transform(self, df):
+    # The per-value transforms and string formatting used before the
+    #   compiled, vectorized formats and transforms
+    if isinstance(getattr(self, 'transforms', None), dict):
+        for col, transform in self.transforms.items():
+            if transform is not None:
+                df[col] = df[col].apply(transform)
+
+    for col in self.formats.keys():
+        df[col] = df[col].map(lambda x: float(self.formats[col] % x))
+
+    return df
+
+
+class LegacySpatioTemporalMatrix(SpatioTemporalMatrix):
+    __transform__ = legacy_transform
+
+
+class LegacyXCO2Matrix(XCO2Matrix):
+    __transform__ = legacy_transform
+
+
+class LegacyKrigedXCO2Matrix(KrigedXCO2Matrix):
+    __transform__ = legacy_transform
+
+    def __init__(self, *args, **kwargs):
+        super(LegacyKrigedXCO2Matrix, self).__init__(*args, **kwargs)
+        self.transforms = {
+            'errors': lambda x: x ** 0.5
+        }
+
+
+class LegacyTimestampsXCO2Matrix(XCO2Matrix):
+    def __dates__(self, timestamps):
+        dates = timestamps.map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S'))\
+            .unique().tolist()
+        dates.sort(lambda x, y: cmp(y, x))
+        return dates
+
+    def __timestamps__(self, df):
+        t = []
+        for i, series in df.iterrows():
+            t.append(datetime.datetime(int(series['%Y']), 1, 1) + datetime.timedelta(days=int(series['%j'])))
+
+        return pd.Series(t, dtype='datetime64[ns]')
+
+
+def time_extract(instance, number, method='extract'):
+    '''Returns the mean time (in seconds) to extract() from an instance'''
+    def extract():
+        instance.__cache__ = None # Defeat memoization
+        getattr(instance, method)()
+
+    return timeit.timeit(extract, number=number) / number
+
+
+def benchmark_formats(number=10):
+    '''Per-file extraction with per-value versus vectorized formats'''
+    cases = (
+        ('casagfed2004.mat', SpatioTemporalMatrix, LegacySpatioTemporalMatrix,
+            {'timestamp': '2004-06-30T00:00:00'}),
+        ('xco2.mat', XCO2Matrix, LegacyXCO2Matrix, {'timestamp': '2009-06-15'}),
+        ('kriged_xco2.mat', KrigedXCO2Matrix, LegacyKrigedXCO2Matrix,
+            {'timestamp': '2009-06-15'}),
+    )
+
+    print 'Per-file extract() with per-value vs. vectorized formats/transforms'
+    for filename, model, legacy, kwargs in cases:
+        path = os.path.join(PATH, filename)
+        before = time_extract(legacy(path, **kwargs), number)
+        after = time_extract(model(path, **kwargs), number)
+        print '    %-20s %8.2f ms %8.2f ms %6.1fx' % (filename, before * 1000,
+            after * 1000, before / after)
+
+
+def benchmark_timestamps(retrievals=1000000, number=1):
+    '''
+    Creating the timestamps and dates of a synthetic file of XCO2 retrievals
+    with per-row versus vectorized datetime arithmetic
+    '''
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'XCO2_20090615_synthetic.mat')
+    data = np.random.RandomState(0).rand(retrievals, 6)
+    data[:, 0] = data[:, 0] * 360 - 180
+    data[:, 1] = data[:, 1] * 180 - 90
+    data[:, 2] = data[:, 2] * 20 + 380
+    data[:, 3] = np.floor(data[:, 3] * 365)
+    data[:, 4] = np.floor(data[:, 4] * 4) + 2009
+    scipy.io.savemat(path, {'XCO2': data}, do_compression=False)
+
+    try:
+        legacy = LegacyTimestampsXCO2Matrix(path)
+        model = XCO2Matrix(path)
+        assert legacy.extract().equals(model.extract()), 'Mismatched extract()'
+        assert legacy.describe() == model.describe(), 'Mismatched describe()'
+
+        print 'Synthetic file of %d XCO2 retrievals with per-row vs. vectorized timestamps' % retrievals
+        for method in ('extract', 'describe'):
+            before = time_extract(legacy, number, method)
+            after = time_extract(model, number, method)
+            print '    %-20s %8.2f ms %8.2f ms %6.1fx' % (method + '()',
+                before * 1000, after * 1000, before / after)
+
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    benchmark_formats()
+    benchmark_timestamps()
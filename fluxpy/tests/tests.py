@@ -1,18 +1,39 @@
 import ast
+import io
 import sys
 import csv
+import shutil
+import struct
+import tempfile
 import datetime
+import math
 import os
 import unittest
 import subprocess
 import pandas as pd
 import numpy as np
 import h5py
+import matplotlib
+matplotlib.use('Agg') # Legends are drawn without a display
+import matplotlib.image
+import matplotlib.pyplot as plt
+import scipy.io
 from pymongo import MongoClient
 from fluxpy import __path__ as fluxpy_module_path
 from fluxpy import DB
-from fluxpy.models import KrigedXCO2Matrix, SpatioTemporalMatrix, XCO2Matrix
-from fluxpy.mediators import Grid3DMediator, Grid4DMediator, Unstructured3DMediator, DB
+from fluxpy.models import CovarianceMatrix, KrigedXCO2Matrix, SpatioTemporalMatrix, XCO2Matrix
+from fluxpy.models import compile_format, compile_transform, stable_repr
+from fluxpy.matlab import MatFile, is_hdf5
+from fluxpy import classification
+from fluxpy.covariance import quadratic_forms, region_weights
+from fluxpy.inventory import Inventory, select_paths
+from fluxpy.mediators import CovarianceMediator, Grid3DMediator, Grid4DMediator, Unstructured3DMediator, DB
+from fluxpy.outputs import AnimatedKMLView, Legend, RasterKMLView, StaticKMLView, TiledKMLView
+from fluxpy.utils import bulk_save, parse_size, plan_bulk_save
+from lxml import etree
+from pykml.factory import KML_ElementMaker as KML
+from pykml.factory import nsmap
+from zipfile import ZipFile
 
 FNULL = open(os.devnull, 'w')
 
@@ -55,6 +76,40 @@ class TestManage(unittest.TestCase):
         cmd = 'python ../../manage.py remove -n casa_gfed_load_test'
         subprocess.call(cmd, shell=True, stdout=FNULL, stderr=subprocess.STDOUT)
 
+    def test_load_command_directory(self):
+        '''
+        Tests that manage.py load loads a directory of files in parallel,
+        reporting the files that could not be loaded without aborting, then
+        exiting with an error status
+        '''
+        cmd = 'python ../../manage.py remove -n casa_gfed_load_test'
+        subprocess.call(cmd, shell=True, stdout=FNULL, stderr=subprocess.STDOUT)
+
+        # Only casagfed2004.mat has a config file (with a timestamp)
+        cmd = '''python ../../manage.py load -p . -n casa_gfed_load_test -m SpatioTemporalMatrix -w 2'''
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        result = process.communicate()[0]
+        self.assertEqual(process.returncode, 1)
+        self.assertGreater(len(result.split('Failed to load 2 of 3 file(s)')),1)
+        self.assertEqual(len(result.split('Upload complete!')),1)
+
+        document = self.db['metadata'].find({'_id': 'casa_gfed_load_test'})
+        self.assertGreater(document.count(),0)
+        self.assertEqual(self.db['casa_gfed_load_test'].count(), 8)
+
+        cmd = 'python ../../manage.py remove -n casa_gfed_load_test'
+        subprocess.call(cmd, shell=True, stdout=FNULL, stderr=subprocess.STDOUT)
+
+    def test_inspect_command(self):
+        '''
+        Tests that manage.py inspect describes each file without loading it
+        '''
+        cmd = '''python ../../manage.py inspect -p casagfed2004.mat -m SpatioTemporalMatrix'''
+        result = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
+        self.assertGreater(len(result.split('casa_gfed_2004 (2635, 10)')),1)
+        self.assertGreater(len(result.split('Inspected 1 file(s) (0 failed)')),1)
+
     def test_db_tools(self):
         '''
         commands to test:
@@ -144,6 +199,509 @@ class TestManage(unittest.TestCase):
         cmd = 'python ../../manage.py remove -n fancypants'
         subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
 
+class TestFormats(unittest.TestCase):
+    '''Tests the compiled, vectorized formats and transforms'''
+
+    values = np.array([0.125, 1.0 / 3, -165.49999, 386.785, 2.0], dtype='float32')
+
+    def test_compile_format(self):
+        '''Should round like np.round(), as formatting and parsing these values would'''
+        for fmt in ('%.0f', '%.2f', '%.5f', '%d', '%.3e'):
+            self.assertEqual(compile_format(fmt)(self.values).tolist(),
+                [float(fmt % x) for x in self.values])
+
+    def test_compile_transform(self):
+        '''Should map known transforms to ufuncs, calling anything else per value'''
+        self.assertIs(compile_transform('sqrt'), np.sqrt)
+        self.assertIs(compile_transform(math.sqrt), np.sqrt)
+        self.assertEqual(compile_transform(lambda x: x * 2)(self.values).tolist(),
+            [x * 2 for x in self.values])
+
+    def test_stable_repr(self):
+        '''Should represent transforms the same way in every process'''
+        code = ('import math; from fluxpy.models import stable_repr; '
+            'print stable_repr({"values": lambda x: x * 2, "errors": math.sqrt}, True)')
+        outputs = [subprocess.check_output([sys.executable, '-c', code])
+            for i in range(2)]
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(' at 0x' in outputs[0], False)
+
+        k = 3
+        self.assertNotEqual(stable_repr(lambda x: x * 2), stable_repr(lambda x: x * 3))
+        self.assertNotEqual(stable_repr(lambda x: x * k), stable_repr(lambda x: x * 2))
+        self.assertRaises(TypeError, stable_repr, np.vectorize(abs), True)
+
+
+class TestMatFile(unittest.TestCase):
+    '''Tests selective reading of Matlab files'''
+
+    path = os.path.join(fluxpy_module_path[0], 'tests')
+
+    def test_read_compressed(self):
+        '''Should list the variables and read only the requested variable'''
+        path = os.path.join(self.path, 'casagfed2004.mat')
+        mat = MatFile(path)
+
+        self.assertEqual(is_hdf5(path), False)
+        self.assertEqual(mat.keys(), ['casa_gfed_2004'])
+        self.assertEqual(mat.variables, {})
+        self.assertTrue(np.array_equal(mat.get('casa_gfed_2004'),
+            scipy.io.loadmat(path)['casa_gfed_2004']))
+        self.assertEqual(mat.get('missing'), None)
+
+    def test_read_uncompressed(self):
+        '''Should memory-map uncompressed numeric arrays'''
+        data = np.arange(12, dtype='float64').reshape(3, 4)
+        path = os.path.join(tempfile.mkdtemp(), 'uncompressed.mat')
+        scipy.io.savemat(path, {'data': data, 'name': 'test'},
+            do_compression=False)
+
+        mat = MatFile(path)
+        self.assertEqual(sorted(mat.keys()), ['data', 'name'])
+        self.assertTrue(isinstance(mat.get('data'), np.memmap))
+        self.assertTrue(np.array_equal(mat.get('data'), data))
+        self.assertEqual(mat.get('name').tolist(), ['test'])
+        os.remove(path)
+
+    def test_read_big_endian(self):
+        '''Should read arrays in a big-endian file in the native byte order'''
+        data = np.arange(12, dtype='float64').reshape(3, 4)
+        path = os.path.join(tempfile.mkdtemp(), 'big_endian.mat')
+
+        # A Level 5 MAT-file with the 'MI' byte order indicator, holding one
+        #   uncompressed miMATRIX element of double-precision numbers
+        elements = ''.join((
+            struct.pack('>IIII', 6, 8, 6, 0), # Array flags (mxDOUBLE_CLASS)
+            struct.pack('>IIii', 5, 8, 3, 4), # Dimensions
+            struct.pack('>II', 1, 4) + 'data'.ljust(8, '\0'), # Name
+            struct.pack('>II', 9, data.nbytes),
+            data.astype('>f8').tostring(order='F')))
+        with open(path, 'wb') as stream:
+            stream.write('MATLAB 5.0 MAT-file'.ljust(124))
+            stream.write(struct.pack('>H', 0x0100) + 'MI')
+            stream.write(struct.pack('>II', 14, len(elements)) + elements)
+
+        mat = MatFile(path)
+        self.assertEqual(mat.keys(), ['data'])
+        self.assertTrue(mat.get('data').dtype.isnative)
+        self.assertTrue(np.array_equal(mat.get('data'), data))
+        self.assertTrue(np.array_equal(mat.get('data'),
+            scipy.io.loadmat(path)['data']))
+        self.assertTrue(np.array_equal(
+            pd.DataFrame(mat.get('data')).values, data))
+        os.remove(path)
+
+
+class TestKMLViews(unittest.TestCase):
+    '''Tests the KML outputs'''
+
+    class Model:
+        # The parts of a model that a view needs
+        columns = ['values', 'errors']
+        grid = {'units': 'degrees', 'x': 0.5, 'y': 0.5}
+        units = ['ppm', 'ppm']
+
+    collection_name = 'test_kml'
+    mediator = Grid3DMediator()
+
+    def setUp(self):
+        self.tearDown()
+
+    def tearDown(self):
+        # Clean up: Remove the test collection and its coordinates
+        self.mediator.client[self.mediator.db_name].drop_collection(self.collection_name)
+        self.mediator.client[self.mediator.db_name]['coord_index'].remove({
+            '_id': self.collection_name
+        })
+
+    def save_frames(self, frames):
+        # Stores DataFrames (of x, y, values and, optionally, errors) by ISO
+        #   8601 timestamp as frames of a Grid3DMediator collection
+        for timestamp, df in sorted(frames.items()):
+            errors = df['errors'] if 'errors' in df else pd.Series(np.nan, df.index)
+            self.mediator.write(self.collection_name, df[['x', 'y']].values.tolist(), [{
+                '_id': datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S'),
+                'values': df['values'].tolist(),
+                'errors': errors.tolist()
+            }])
+
+    def test_write_streaming(self):
+        '''Should write the same document as serializing it all at once'''
+        view = StaticKMLView(None, self.Model, 'test')
+        preamble = [KML.name('test'), view.__tour__()]
+        placemarks = [KML.Placemark(KML.styleUrl('#%d' % i), KML.Polygon(
+            KML.outerBoundaryIs(KML.LinearRing(KML.coordinates(
+                view.__square_bounds__((i + 0.25, -i - 0.25), 100 * i))))))
+            for i in range(3)]
+
+        path = os.path.join(tempfile.mkdtemp(), 'test.kml')
+        view.__write__(path, preamble, 'frame', iter(placemarks))
+        with open(path, 'rb') as stream:
+            self.assertEqual(stream.read(), etree.tostring(KML.Document(*(preamble +
+                [KML.Folder(KML.name('frame'), *placemarks)]))))
+
+        shutil.rmtree(os.path.dirname(path))
+
+    def test_square_rings(self):
+        '''Should format the corners of every cell at once, skipping NaNs'''
+        view = StaticKMLView(None, self.Model, 'test')
+        rings = view.__square_rings__([-179.75, np.nan, 10.1], [0.25, 1.0, -3.3],
+            [math.pow(2.5, 2), 1.0, 1e6 / 3])
+
+        self.assertEqual(rings[0], '-180.0,0.5,6.25 -180.0,0.0,6.25 '
+            '-179.5,0.0,6.25 -179.5,0.5,6.25 -180.0,0.5,6.25')
+        self.assertEqual(rings[1], None)
+        self.assertEqual(rings[2].split(' ')[0], '9.85,-3.05,333333.333333')
+        self.assertEqual(view.__square_bounds__((10.1, -3.3)), '9.85,-3.05 9.85,-3.55 10.35,-3.55 10.35,-3.05 9.85,-3.05')
+
+    def test_square_geometry_cached(self):
+        '''Should format the cells of a grid once, splicing in each frame's altitudes'''
+        view = StaticKMLView(None, self.Model, 'test')
+        x, y = np.array([0.25, 0.75]), np.array([0.25, 0.25])
+        first = view.__square_rings__(x, y, [1.0, 2.0])
+        self.assertEqual(len(view.__geometries__), 1)
+        self.assertEqual(view.__square_rings__(x, y).tolist(),
+            [r.replace(',1.0', '').replace(',2.0', '') for r in first])
+        self.assertEqual(view.__square_rings__(x, y, [3.0, 2.0])[0],
+            first[0].replace(',1.0', ',3.0'))
+        self.assertEqual(len(view.__geometries__), 1)
+
+    def test_render_static(self):
+        '''Should draw each cell one grid resolution wide, styled by its bin'''
+        self.save_frames({'2009-06-01T00:00:00': pd.DataFrame({
+            'errors': [0.1, 0.2, 0.3],
+            'values': [380.0, 385.0, 390.0],
+            'x': [0.25, 0.75, 0.25],
+            'y': [0.25, 0.25, 0.75]
+        })})
+
+        output_path = tempfile.mkdtemp()
+        (path, legend), = StaticKMLView(self.mediator, self.Model,
+            self.collection_name).render({}, output_path, bins=3, color='BuGn3')
+
+        # The cells tile the grid without overlapping; the altitude encodes
+        #   the errors
+        ns = '{%s}' % nsmap[None]
+        self.assertEqual([(p.findtext('%sstyleUrl' % ns), p.findtext('.//%scoordinates' % ns))
+            for p in etree.parse(path).iter(ns + 'Placemark')], [
+            ('#</= 382.5 ppm', '0.0,0.5,10000.0 0.0,0.0,10000.0 0.5,0.0,10000.0 '
+                '0.5,0.5,10000.0 0.0,0.5,10000.0'),
+            ('#(382.5 - 387.5] ppm', '0.5,0.5,40000.0 0.5,0.0,40000.0 1.0,0.0,40000.0 '
+                '1.0,0.5,40000.0 0.5,0.5,40000.0'),
+            ('#> 387.5 ppm', '0.0,1.0,90000.0 0.0,0.5,90000.0 0.5,0.5,90000.0 '
+                '0.5,1.0,90000.0 0.0,1.0,90000.0')
+        ])
+        shutil.rmtree(output_path)
+
+    def test_render_parallel(self):
+        '''Should render the same files, in the same order, with a pool of workers'''
+        self.save_frames(dict([('2009-06-0%dT00:00:00' % (d + 1), pd.DataFrame({
+            'errors': np.linspace(0.1, 1.0, 8) * (d + 1),
+            'values': np.linspace(380.0, 390.0, 8)[::(1 if d % 2 else -1)],
+            'x': np.arange(8) + 0.25,
+            'y': np.arange(8) * 0.5
+        })) for d in range(3)]))
+
+        outputs = []
+        for workers in (1, 2):
+            output_path = tempfile.mkdtemp()
+            paths = StaticKMLView(self.mediator, self.Model, self.collection_name).render({},
+                output_path, bins=3, color='BuGn3', workers=workers)
+            outputs.append([[os.path.basename(p) for p in pair] for pair in paths])
+            outputs.append([open(p, 'rb').read() for p, legend in paths])
+            shutil.rmtree(output_path)
+
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertEqual(outputs[1], outputs[3])
+
+    def test_render_raster(self):
+        '''Should draw one pixel per grid cell, colored as the static view does'''
+        self.save_frames({'2009-06-01T00:00:00': pd.DataFrame({
+            'values': [1.0, 2.0, 3.0, np.nan, 10.0],
+            'x': [-1.25, -0.75, -0.25, -1.25, -0.25],
+            'y': [0.75, 0.75, 0.75, 0.25, 0.25]
+        })})
+
+        output_path = tempfile.mkdtemp()
+        (kmz, legend), = RasterKMLView(self.mediator, self.Model, self.collection_name).render({},
+            output_path, bins=3, color='BuGn3')
+
+        with ZipFile(kmz) as archive:
+            names = archive.namelist()
+            document = etree.fromstring(archive.read(names[0]))
+            image = (matplotlib.image.imread(
+                io.BytesIO(archive.read(names[1]))) * 255).round()
+
+        self.assertEqual(names, ['2009-06-01T00:00:00_0.kml',
+            '2009-06-01T00:00:00_0.png', '2009-06-01T00:00:00.png'])
+        box = document.find('.//{%s}LatLonBox' % nsmap[None])
+        self.assertEqual([float(box.find('{%s}%s' % (nsmap[None], k)).text)
+            for k in ('north', 'south', 'east', 'west')], [1.0, 0.0, 0.0, -1.5])
+
+        # The highest bin has the first color; NaNs and missing cells are clear
+        self.assertEqual(image.shape, (2, 3, 4))
+        self.assertEqual(list(image[1, 2]), [229, 245, 249, 255])
+        self.assertEqual(list(image[0, 0]), [44, 162, 95, 255])
+        self.assertEqual(list(image[1, 0]), [0, 0, 0, 0])
+        self.assertEqual(list(image[1, 1]), [0, 0, 0, 0])
+        shutil.rmtree(output_path)
+
+    def test_render_tiles(self):
+        '''Should write a quadtree of tiles, coarse tiles averaging blocks of cells'''
+        x, y = np.meshgrid(np.arange(4) * 0.5 + 0.25, np.arange(4) * 0.5 + 0.25)
+        self.save_frames({'2009-06-01T00:00:00': pd.DataFrame({
+            'values': np.arange(16.0),
+            'x': x.ravel(),
+            'y': y.ravel()
+        })})
+
+        class View(TiledKMLView):
+            tile_size = 2
+
+        output_path = tempfile.mkdtemp()
+        (top, legend), = View(self.mediator, self.Model, self.collection_name).render({},
+            output_path, bins=3, color='BuGn3')
+
+        ns = '{%s}' % nsmap[None]
+        tiles = dict([(f, etree.parse(os.path.join(output_path, f)))
+            for f in os.listdir(output_path) if f.endswith('.kml')])
+        self.assertEqual(sorted(tiles.keys()), ['2009-06-01T00:00:00_0.kml'] + [
+            '2009-06-01T00:00:00_0_%d.kml' % q for q in range(4)])
+
+        # The top tile links to each quarter and draws blocks of 2x2 cells
+        root = tiles[os.path.basename(top)]
+        self.assertEqual([e.text for e in root.iter(ns + 'href')][1:], [
+            '2009-06-01T00:00:00_0_%d.kml' % q for q in range(4)])
+        self.assertEqual([e.text for e in root.iter(ns + 'maxLodPixels')][0], '256')
+        self.assertEqual([e.text.split('value: ')[1].split(' ')[0]
+            for e in root.iter(ns + 'description')], ['2.5', '4.5', '10.5', '12.5'])
+
+        # The quarters draw the grid cells
+        self.assertEqual(sum([len(list(t.iter(ns + 'Placemark')))
+            for f, t in tiles.items() if t is not root]), 16)
+        shutil.rmtree(output_path)
+
+    def test_render_animated(self):
+        '''Should write a placemark for each run of a cell's class in one document'''
+        self.save_frames(dict([('2009-06-0%dT00:00:00' % (d + 1), pd.DataFrame({
+            'values': values,
+            'x': [0.25, 0.75, 1.25],
+            'y': [0.25, 0.25, 0.25]
+        })) for d, values in enumerate(([1.0, 5.0, 9.0], [1.0, 5.0, 1.0],
+            [1.0, np.nan, 1.0]))]))
+
+        output_path = tempfile.mkdtemp()
+        (path, legend), = AnimatedKMLView(self.mediator, self.Model, self.collection_name).render({},
+            output_path, bins=3, color='BuGn3', breakpoints=[-np.inf, 3, 6, np.inf])
+
+        ns = '{%s}' % nsmap[None]
+        runs = [(p.findtext('.//%sbegin' % ns)[:10], p.findtext('.//%send' % ns),
+            p.findtext('%sstyleUrl' % ns), p.findtext('.//%scoordinates' % ns).split(',')[0])
+            for p in etree.parse(path).iter(ns + 'Placemark')]
+        self.assertEqual(runs, [
+            ('2009-06-01', '2009-06-02T00:00:00', '#> 6.0 ppm', '1.0'),
+            ('2009-06-01', '2009-06-03T00:00:00', '#(3.0 - 6.0] ppm', '0.5'),
+            ('2009-06-01', None, '#</= 3.0 ppm', '0.0'),
+            ('2009-06-02', None, '#</= 3.0 ppm', '1.0')
+        ])
+        shutil.rmtree(output_path)
+
+    def test_render_schemes(self):
+        '''Should bin and label the values by the given classification scheme'''
+        self.save_frames({'2009-06-01T00:00:00': pd.DataFrame({
+            'errors': np.ones(6),
+            'values': [380.01, 380.02, 380.035, 380.04, 380.1, 380.11],
+            'x': np.arange(6) + 0.25,
+            'y': np.zeros(6) + 0.25
+        })})
+
+        output_path = tempfile.mkdtemp()
+        (path, legend), = StaticKMLView(self.mediator, self.Model, self.collection_name).render({},
+            output_path, bins=('jenks', 3), color='BuGn3')
+
+        ns = '{%s}' % nsmap[None]
+        document = etree.parse(path)
+        # One decimal would not tell the breakpoints apart
+        self.assertEqual([e.get('id') for e in document.iter(ns + 'Style')], [
+            '> 380.04 ppm', '(380.02 - 380.04] ppm', '</= 380.02 ppm'])
+        self.assertEqual([e.text for e in document.iter(ns + 'styleUrl')],
+            ['#</= 380.02 ppm'] * 2 + ['#(380.02 - 380.04] ppm'] * 2 +
+            ['#> 380.04 ppm'] * 2)
+        shutil.rmtree(output_path)
+
+    def test_legend_cached(self):
+        '''Should draw the same legend once per directory and close its figure'''
+        entries = [('#ff0000', '0-1'), ('#00ff00', '1-2')]
+        paths = [tempfile.mkdtemp() for i in range(2)]
+        before = Legend.cache_info()
+
+        files = [Legend((2.5, 5.0), list(entries), paths[0], 'a').render(),
+            Legend((2.5, 5.0), list(entries), paths[0], 'b').render(),
+            Legend((2.5, 5.0), list(entries), paths[0], 'a').render(),
+            Legend((2.5, 5.0), list(entries), paths[1], 'a').render()]
+
+        after = Legend.cache_info()
+        self.assertEqual(after['misses'] - before['misses'], 2)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(len(set([open(f, 'rb').read() for f in files])), 1)
+        self.assertEqual(plt.get_fignums(), [])
+
+        for path in paths:
+            shutil.rmtree(path)
+
+
+class TestClassification(unittest.TestCase):
+    '''Tests the classification of values for the outputs'''
+
+    def test_breakpoints(self):
+        '''Should bin values as pandas.cut() does, with -1 for no value'''
+        self.assertEqual(list(classification.breakpoints(380.0, 2.0, 3)),
+            [-np.inf, 379.0, 381.0, np.inf])
+        self.assertEqual(list(classification.breakpoints(0.0, 1.0, 4)),
+            [-np.inf, -1.0, 0.0, 1.0, np.inf])
+
+        values = np.array([-2.0, -1.0, -0.5, 0.0, np.nan, 0.5, 1.0, 3.0])
+        breakpoints = classification.breakpoints(0.0, 1.0, 4)
+        self.assertEqual(list(classification.classify(values, breakpoints)),
+            [0, 0, 1, 1, -1, 2, 2, 3])
+        self.assertEqual(list(classification.classify(values, breakpoints)),
+            list(pd.Series(pd.cut(values, breakpoints, labels=False)).fillna(-1)))
+
+    def test_schemes(self):
+        '''Should find equal interval, quantile and natural breakpoints'''
+        values = np.array([1.0, 2.0, 3.0, 10.0, 11.0, 12.0, 20.0, 21.0, 22.0, np.nan])
+        self.assertEqual(list(classification.equal_intervals(values, 3)),
+            [-np.inf, 8.0, 15.0, np.inf])
+        self.assertTrue(np.allclose(classification.quantiles(values, 3),
+            [-np.inf, 7.0 + 2.0 / 3, 14.0 + 2.0 / 3, np.inf]))
+        self.assertEqual(list(classification.natural_breaks(values, 3)),
+            [-np.inf, 3.0, 12.0, np.inf])
+
+        # Tied values (or more classes than distinct values) give fewer,
+        #   distinct breakpoints
+        tied = np.concatenate((np.zeros(900), np.linspace(0.5, 1.0, 100)))
+        self.assertEqual(list(classification.quantiles(tied, 5)),
+            [-np.inf, 0.0, np.inf])
+        self.assertEqual(list(classification.natural_breaks([1.0, 2.0], 3)),
+            [-np.inf, 1.0, np.inf])
+        self.assertEqual(list(classification.equal_intervals(np.ones(4), 3)),
+            [-np.inf, 1.0, np.inf])
+
+        self.assertEqual(classification.parse_bins(3), ('stddev', 3))
+        self.assertEqual(classification.parse_bins(('jenks', 5)), ('jenks', 5))
+        self.assertRaises(ValueError, classification.parse_bins, ('kmeans', 5))
+        self.assertRaises(TypeError, classification.parse_bins, 3.0)
+
+    def test_collection_stats(self):
+        '''Should classify with the summary statistics of the collection'''
+        mediator = Grid3DMediator()
+        mediator.client[mediator.db_name]['metadata'].insert({
+            '_id': 'test_classification',
+            'stats': {'values': {'mean': 380.0, 'std': 2.0}}
+        })
+
+        try:
+            self.assertEqual(classification.collection_stats(mediator,
+                'test_classification', ['values']), {'values': (380.0, 2.0)})
+            self.assertRaises(ValueError, classification.collection_stats,
+                mediator, 'test_classification', ['errors'])
+
+        finally:
+            mediator.client[mediator.db_name]['metadata'].remove({
+                '_id': 'test_classification'
+            })
+
+
+class TestCovarianceMatrix(unittest.TestCase):
+    '''Tests for reading covariance matrices in blocks of rows'''
+
+    @classmethod
+    def setUpClass(cls):
+        random = np.random.RandomState(0).randn(50, 50)
+        cls.matrix = np.round(random.dot(random.T) / 50, 5)
+        cls.path = os.path.join(tempfile.mkdtemp(), 'covariance.h5')
+        with h5py.File(cls.path, 'w') as f:
+            f['covariance'] = cls.matrix
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+        mediator = CovarianceMediator()
+        mediator.client[mediator.db_name].drop_collection('test_covariance')
+        for name in ('coord_index', 'metadata'):
+            mediator.client[mediator.db_name][name].remove({
+                '_id': 'test_covariance'
+            })
+
+    def test_block_products(self):
+        '''Should compute products one block of rows at a time'''
+        cov = CovarianceMatrix(self.path, timestamp='2008-01')
+        weights = np.random.RandomState(1).rand(50, 3)
+
+        self.assertEqual([start for start, block in cov.iter_blocks(20)], [0, 20, 40])
+        self.assertTrue(np.allclose(cov.dot(weights, chunk_rows=20),
+            self.matrix.dot(weights)))
+
+    def test_quadratic_forms(self):
+        '''Should compute w'Cw for each region in one pass over the blocks'''
+        cov = CovarianceMatrix(self.path, timestamp='2008-01')
+        names, weights = region_weights({'a': [0, 1, 2], 'b': range(10, 45)},
+            50, mean=True)
+        dense = weights.toarray()
+
+        self.assertEqual(names, ['a', 'b'])
+        self.assertTrue(np.allclose(quadratic_forms(cov.iter_blocks(20), weights),
+            np.diag(dense.T.dot(self.matrix).dot(dense))))
+
+    def test_pack(self):
+        '''Should store only the (optionally sparsified) upper triangle'''
+        cov = CovarianceMatrix(self.path, timestamp='2008-01')
+
+        packed = cov.pack(chunk_rows=20)
+        self.assertEqual(packed.values.shape, (50 * 51 / 2,))
+        self.assertTrue(np.array_equal(packed.toarray(), self.matrix))
+        self.assertTrue(np.array_equal(packed.row(7), self.matrix[7]))
+
+        sparse = cov.pack(chunk_rows=20, tolerance=0.1)
+        expected = np.where(np.abs(self.matrix) > 0.1, self.matrix, 0)
+        np.fill_diagonal(expected, self.matrix.diagonal())
+        self.assertTrue(np.array_equal(sparse.toarray(), expected))
+        self.assertTrue(np.allclose(sparse.dot(np.ones(50)), expected.sum(1)))
+
+    def test_save_to_db(self):
+        '''Should store the upper triangle as tiles and load blocks of it'''
+        cov = CovarianceMatrix(self.path, timestamp='2008-01')
+        mediator = CovarianceMediator(tile_size=16)
+        mediator.save('test_covariance', cov)
+
+        # Tiles (i, j) for i <= j of a 4-by-4 grid of tiles
+        self.assertEqual(mediator.client[mediator.db_name]['test_covariance'].count(), 10)
+        self.assertTrue(np.array_equal(mediator.load_block('test_covariance',
+            (10, 40), (3, 20)), self.matrix[10:40, 3:20]))
+        self.assertTrue(np.array_equal(mediator.load_row('test_covariance', 37),
+            self.matrix[37]))
+
+    def test_bulk_save(self):
+        '''Should record the layout of the tiles when loaded by bulk_save()'''
+        mediator = CovarianceMediator(tile_size=16)
+        failures = bulk_save(mediator, CovarianceMatrix, 'test_covariance_bulk',
+            [self.path], workers=2, timestamp='2008-01')
+
+        try:
+            self.assertEqual(failures, [])
+            self.assertEqual(mediator.client[mediator.db_name]['test_covariance_bulk'].count(), 10)
+            self.assertTrue(np.array_equal(mediator.load_row('test_covariance_bulk', 37),
+                self.matrix[37]))
+
+        finally:
+            mediator.client[mediator.db_name].drop_collection('test_covariance_bulk')
+            for name in ('coord_index', 'metadata'):
+                mediator.client[mediator.db_name][name].remove({
+                    '_id': 'test_covariance_bulk'
+                })
+
+
 class TestSpatioTemporalMatrixes(unittest.TestCase):
     '''Tests for proper handling of inverted CO2 surface fluxes (e.g. CASA GFED output)'''
 
@@ -154,7 +712,7 @@ class TestSpatioTemporalMatrixes(unittest.TestCase):
     def setUpClass(cls):
         # Clean up: Remove the test collections and references
         mediator = Grid3DMediator()
-        for collection_name in ('test3',):
+        for collection_name in ('test3', 'test3_chunked'):
             mediator.client[mediator.db_name].drop_collection(collection_name)
             mediator.client[mediator.db_name]['coord_index'].remove({
                 '_id': collection_name
@@ -167,7 +725,7 @@ class TestSpatioTemporalMatrixes(unittest.TestCase):
     def tearDownClass(cls):
         # Clean up: Remove the test collections and references
         mediator = Grid3DMediator()
-        for collection_name in ('test3',):
+        for collection_name in ('test3', 'test3_chunked'):
             mediator.client[mediator.db_name].drop_collection(collection_name)
             mediator.client[mediator.db_name]['coord_index'].remove({
                 '_id': collection_name
@@ -214,6 +772,27 @@ class TestSpatioTemporalMatrixes(unittest.TestCase):
         self.assertEqual(str(df.columns[1]), '2004-06-30 03:00:00')
         self.assertEqual(df.index.values[1], (-165.5, 61.5))
 
+    def test_model_from_arrays(self):
+        '''Should create a SpatioTemporalMatrix from arrays in memory'''
+        flux = SpatioTemporalMatrix(os.path.join(self.path, 'casagfed2004.mat'),
+            timestamp='2004-06-30T00:00:00', var_name='casa_gfed_2004')
+        data = scipy.io.loadmat(os.path.join(self.path,
+            'casagfed2004.mat'))['casa_gfed_2004']
+        from_arrays = SpatioTemporalMatrix.from_arrays(data[:, 0:2], data[:, 2:],
+            timestamp='2004-06-30T00:00:00')
+
+        self.assertTrue(from_arrays.extract().equals(flux.extract()))
+        self.assertEqual(from_arrays.describe()['bbox'], flux.describe()['bbox'])
+
+    def test_model_iter_extract(self):
+        '''Should extract the same DataFrame in blocks of time steps'''
+        flux = SpatioTemporalMatrix(os.path.join(self.path, 'casagfed2004.mat'),
+            timestamp='2004-06-30T00:00:00', var_name='casa_gfed_2004')
+
+        blocks = list(flux.iter_extract(chunk_steps=3))
+        self.assertEqual([b.shape for b in blocks], [(2635, 3), (2635, 3), (2635, 2)])
+        self.assertTrue(pd.concat(blocks, axis=1).equals(flux.extract()))
+
     def test_save_to_db(self):
         '''Should successfully save proper data representation to database'''
         flux = SpatioTemporalMatrix(os.path.join(self.path, 'casagfed2004.mat'),
@@ -235,6 +814,37 @@ class TestSpatioTemporalMatrixes(unittest.TestCase):
             'std', 'max', 'min', 'median', 'mean'
         ])
 
+    def test_save_to_db_chunked(self):
+        '''Should save the same documents when streaming blocks of time steps'''
+        flux = SpatioTemporalMatrix(os.path.join(self.path, 'casagfed2004.mat'),
+            timestamp='2004-06-30T00:00:00', var_name='casa_gfed_2004')
+
+        self.mediator.save('test3_chunked', flux, chunk_steps=3)
+        collection = self.mediator.client[self.mediator.db_name]['test3_chunked']
+        self.assertEqual(collection.count(), 8)
+        self.assertEqual(collection.find({
+            '_id': datetime.datetime(2004, 6, 30, 0, 0, 0),
+        })[0]['values'][0], 0.08)
+
+    def test_plan_bulk_save(self):
+        '''Should choose the workers and the chunk size to fit a memory limit'''
+        directory = tempfile.mkdtemp()
+        for name in ('casagfed2004.mat', 'casagfed2004.json'):
+            shutil.copy(os.path.join(self.path, name), directory)
+
+        paths = [os.path.join(directory, 'casagfed2004.mat')]
+        plan = plan_bulk_save(self.mediator, SpatioTemporalMatrix, paths, 2**30, 4)
+        self.assertEqual((plan['workers'], plan['encode_kwargs']), (4, {}))
+        self.assertEqual((plan['shape'], plan['dtype']), ((2635, 10), 'float64'))
+
+        # Too little memory for more than one worker; read fewer time steps
+        limit = self.mediator.estimate((2635, 10), chunk_steps=3)
+        plan = plan_bulk_save(self.mediator, SpatioTemporalMatrix, paths, limit, 4)
+        self.assertEqual((plan['workers'], plan['encode_kwargs']), (1, {'chunk_steps': 3}))
+        self.assertTrue(plan['fits'])
+        self.assertEqual(parse_size('1.5G'), 3 * 2**29)
+        shutil.rmtree(directory)
+
 
 class TestXCO2Data(unittest.TestCase):
     '''Tests for proper handling of XCO2 retrievals'''
@@ -332,6 +942,54 @@ class TestKrigedXCO2Data(unittest.TestCase):
                 '_id': collection_name
             })
 
+    def test_batch_metadata(self):
+        '''Should write the metadata for a batch of saves once, on exit'''
+        db = self.mediator.client[self.mediator.db_name]
+        for name in ('test2_batch', 'test2_sequential'):
+            db.drop_collection(name)
+            db['coord_index'].remove({'_id': name})
+            db['metadata'].remove({'_id': name})
+
+        stamps = ('2009-06-15', '2009-06-21', '2009-06-09')
+        for timestamp in stamps:
+            self.mediator.save('test2_sequential', KrigedXCO2Matrix(
+                os.path.join(self.path, 'kriged_xco2.mat'), timestamp=timestamp))
+
+        with self.mediator.batch('test2_batch'):
+            for timestamp in stamps:
+                self.mediator.save('test2_batch', KrigedXCO2Matrix(
+                    os.path.join(self.path, 'kriged_xco2.mat'), timestamp=timestamp))
+
+                # Nothing is written until the batch is finished
+                self.assertEqual(db['metadata'].find({
+                    '_id': 'test2_batch'
+                }).count(), 0)
+
+        batched = db['metadata'].find({'_id': 'test2_batch'}).next()
+        sequential = db['metadata'].find({'_id': 'test2_sequential'}).next()
+        self.assertEqual(batched['dates'], sequential['dates'])
+        self.assertEqual(batched['spans'], sequential['spans'])
+        self.assertEqual(batched['stats'], sequential['stats'])
+
+        # Forced metadata replace those of the earlier saves, in a batch or not
+        xco2 = KrigedXCO2Matrix(os.path.join(self.path, 'kriged_xco2.mat'),
+            timestamp='2009-06-27')
+        self.mediator.generate_metadata('test2_sequential', xco2, force=True)
+        with self.mediator.batch('test2_batch'):
+            self.mediator.save('test2_batch', KrigedXCO2Matrix(
+                os.path.join(self.path, 'kriged_xco2.mat'), timestamp='2009-06-03'))
+            self.mediator.generate_metadata('test2_batch', xco2, force=True)
+
+        batched = db['metadata'].find({'_id': 'test2_batch'}).next()
+        sequential = db['metadata'].find({'_id': 'test2_sequential'}).next()
+        self.assertEqual(batched['dates'], ['2009-06-27'])
+        self.assertEqual(batched['dates'], sequential['dates'])
+
+        for name in ('test2_batch', 'test2_sequential'):
+            db.drop_collection(name)
+            db['coord_index'].remove({'_id': name})
+            db['metadata'].remove({'_id': name})
+
     def test_model_instance(self):
         '''Should properly instantiate a model instance'''
         xco2 = KrigedXCO2Matrix(os.path.join(self.path, 'kriged_xco2.mat'),
@@ -353,6 +1011,108 @@ class TestKrigedXCO2Data(unittest.TestCase):
         df2 = xco2.extract(timestamp='2010-01-01')
         self.assertEqual(xco2.timestamp, '2010-01-01')
 
+    def test_bulk_save_reads_once(self):
+        '''Should read each file once when it is extracted, encoded and described'''
+        for mediator, model, name, kwargs in (
+                (Grid4DMediator(), SpatioTemporalMatrix, 'casagfed2004.mat', {}),
+                (Grid3DMediator(), KrigedXCO2Matrix, 'kriged_xco2.mat', {'timestamp': '2009-06-15'}),
+                (Unstructured3DMediator(), XCO2Matrix, 'xco2.mat', {'timestamp': '2009-06-15'})):
+            reads = []
+            class Model(model):
+                def __read__(self, *args, **kwargs):
+                    reads.append(args)
+                    return super(Model, self).__read__(*args, **kwargs)
+
+            collection_name = 'test_reads_%s' % model.__name__
+            try:
+                self.assertEqual(bulk_save(mediator, Model, collection_name,
+                    [os.path.join(self.path, name)], **kwargs), [])
+                self.assertEqual(reads, [()])
+
+            finally:
+                mediator.client[mediator.db_name].drop_collection(collection_name)
+                for index in ('coord_index', 'metadata'):
+                    mediator.client[mediator.db_name][index].remove({
+                        '_id': collection_name
+                    })
+
+    def test_model_extract_disk_cache(self):
+        '''Should store the extracted DataFrame and memory-map it next time'''
+        cache_dir = tempfile.mkdtemp()
+        path = os.path.join(self.path, 'kriged_xco2.mat')
+        first = KrigedXCO2Matrix(path, timestamp='2009-06-15', cache_dir=cache_dir)
+        df = first.extract()
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        second = KrigedXCO2Matrix(path, timestamp='2009-06-15', cache_dir=cache_dir)
+        second.file = None # Any attempt to read the file would fail
+        self.assertTrue(second.extract().equals(df))
+
+        # A different configuration is a different entry
+        KrigedXCO2Matrix(path, timestamp='2009-06-15', cache_dir=cache_dir,
+            precision=3).extract()
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        shutil.rmtree(cache_dir)
+
+    def test_inventory_select(self):
+        '''Should select files by time range, opening only new files'''
+        directory = tempfile.mkdtemp()
+        paths = []
+        for name in ('Kriged_20090601_a.mat', 'Kriged_20090701_a.mat'):
+            paths.append(os.path.join(directory, name))
+            shutil.copy(os.path.join(self.path, 'kriged_xco2.mat'), paths[-1])
+
+        inventory = Inventory(directory).refresh(KrigedXCO2Matrix)
+        self.assertEqual(inventory.entries['Kriged_20090601_a.mat']['start'], '2009-06-01T00:00:00')
+        self.assertEqual(inventory.entries['Kriged_20090601_a.mat']['shape'], [14210, 9])
+        self.assertEqual(inventory.select('2009-06-03', '2009-06-30'), paths[:1])
+        self.assertEqual(inventory.select(start='2009-06-15'), paths[1:])
+
+        # The inventory persists; unchanged files are not opened again
+        inventory.entries['Kriged_20090601_a.mat']['var_name'] = 'unchanged'
+        inventory.save()
+        self.assertEqual(select_paths(paths, KrigedXCO2Matrix, end='2009-06-15'), paths[:1])
+        self.assertEqual(Inventory(directory).entries['Kriged_20090601_a.mat']['var_name'], 'unchanged')
+
+        # Nor are they in another process, with a function in the configuration
+        code = ('from fluxpy.inventory import Inventory; '
+            'from fluxpy.models import KrigedXCO2Matrix; '
+            'Inventory(%r).refresh(KrigedXCO2Matrix, transforms={"errors": lambda x: x})' % directory)
+        subprocess.check_call([sys.executable, '-c', code])
+        inventory = Inventory(directory)
+        inventory.entries['Kriged_20090601_a.mat']['var_name'] = 'unchanged'
+        inventory.save()
+        subprocess.check_call([sys.executable, '-c', code])
+        self.assertEqual(Inventory(directory).entries['Kriged_20090601_a.mat']['var_name'], 'unchanged')
+        shutil.rmtree(directory)
+
+    def test_model_describe_without_extract(self):
+        '''Should describe a model instance from its coordinates alone'''
+        xco2 = KrigedXCO2Matrix(os.path.join(self.path, 'kriged_xco2.mat'),
+            timestamp='2009-06-15')
+
+        metadata = xco2.inspect()
+        self.assertEqual(metadata['bbox'], (-179.5, -54.5, 179.5, 82.5))
+        self.assertEqual(metadata['shape'], (14210, 9))
+        self.assertEqual(metadata['variables'], ['krigedData'])
+        self.assertEqual(xco2.__cache__.has_key('extract'), False)
+        self.assertEqual(metadata['bboxmd5'], xco2.describe(xco2.extract())['bboxmd5'])
+
+    def test_model_extract_memoized(self):
+        '''Should extract once per configuration; transforms applied once'''
+        xco2 = KrigedXCO2Matrix(os.path.join(self.path, 'kriged_xco2.mat'),
+            timestamp='2009-06-15')
+
+        df1 = xco2.extract()
+        self.assertIs(xco2.extract(), df1)
+        self.assertIs(xco2.describe(), xco2.describe())
+
+        # A change in the configuration invalidates the memoized DataFrame
+        df2 = xco2.extract(timestamp='2010-01-01')
+        self.assertIsNot(df2, df1)
+        self.assertEqual(xco2.describe()['dates'], ['2010-01-01'])
+        self.assertEqual(df2['errors'].tolist(), df1['errors'].tolist())
+
     def test_save_to_db(self):
         '''Should successfully save proper data representation to database'''
         xco2 = KrigedXCO2Matrix(os.path.join(self.path, 'kriged_xco2.mat'),
@@ -1,16 +1,207 @@
 import os
 import sys
 import re
+import traceback
+import multiprocessing
 import pandas as pd
 import numpy as np
 from pymongo.errors import DuplicateKeyError
+from fluxpy.inventory import Inventory, select_paths
+
+def _extract_and_encode(args, materialize=True):
+    '''
+    Instantiates the model for a single file, then extracts and encodes its
+    data with the mediator (or, in a worker process, a new instance of the
+    mediator class); it returns any error as a string. The documents are
+    returned as a list unless materialize is False, in which case they may
+    be generated as they are inserted.
+    '''
+    mediator, model, path, encode_kwargs, kwargs = args
+    if isinstance(mediator, type):
+        mediator = mediator()
+
+    try:
+        instance = model(path, **kwargs)
+        coords, documents = mediator.encode(instance, **encode_kwargs)
+        if materialize:
+            documents = list(documents)
+
+        return (path, coords, documents,
+            mediator.describe(instance, coords, **encode_kwargs), None)
+
+    except Exception:
+        return (path, None, None, None, traceback.format_exc())
+
+
+def bulk_save(mediator, model, collection_name, paths, workers=1,
+        encode_kwargs=None, verbose=False, **kwargs):
+    '''
+    Saves the data in each of the file paths to a collection. Files are
+    extracted and encoded in parallel by a pool of worker processes while
+    this process inserts the documents; the metadata are merged once every
+    file has been inserted. With one worker, files are extracted and encoded
+    in this process, one at a time, as they are inserted, as they also are
+    for a mediator that cannot encode in a worker (e.g. the tiles of a
+    CovarianceMediator). A file that fails is reported and skipped.
+    Additional keyword arguments are passed to the model. Returns a list of
+    (path, error message) tuples, one for each file that failed. The batches
+    are not sized here: to stay under a memory limit, choose the workers and
+    the encode_kwargs (e.g. chunk_steps, the time steps per document) with
+    plan_bulk_save().
+    '''
+    failures = []
+
+    if workers > 1 and mediator.parallel:
+        tasks = [(mediator.__class__, model, path, encode_kwargs or {}, kwargs)
+            for path in paths]
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_extract_and_encode, tasks)
+
+    else:
+        # One file at a time, with its documents inserted as they are
+        #   generated (e.g. one block of time steps at a time)
+        tasks = [(mediator, model, path, encode_kwargs or {}, kwargs)
+            for path in paths]
+        pool = None
+        results = (_extract_and_encode(task, materialize=False) for task in tasks)
+
+    try:
+        # Metadata are merged in memory and written once, at the end
+        with mediator.batch(collection_name, verbose=verbose):
+            for i, (path, coords, documents, metadata, error) in enumerate(results):
+                if verbose: sys.stderr.write('\rSaving %d of %d (%s)...'
+                                     % (i + 1, len(tasks), os.path.basename(path)))
+
+                if error is None:
+                    try:
+                        mediator.write(collection_name, coords, documents)
+                        mediator.generate_metadata(collection_name, None,
+                            metadata=metadata)
+
+                    except Exception:
+                        error = traceback.format_exc()
+
+                if error is not None:
+                    failures.append((path, error))
+                    if verbose: sys.stderr.write('\nSkipping %s:\n%s'
+                                         % (os.path.basename(path), error))
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return failures
+
+
+def format_size(size):
+    '''Formats a number of bytes e.g. as "1.5 GB"'''
+    if size < 1024:
+        return '%d bytes' % size
+
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'TB':
+            return '%.1f %s' % (size, unit)
+
+
+def parse_size(size):
+    '''Returns the number of bytes in a size such as "512M", "4G" or "4GB"'''
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(size).upper())
+    if match is None:
+        raise ValueError('Could not understand the size "%s"' % size)
+
+    number, unit = match.groups()
+    return int(float(number) * 1024**' KMGT'.index(unit or ' '))
+
+
+def plan_bulk_save(mediator, model, paths, memory_limit, workers=1,
+        encode_kwargs=None, **kwargs):
+    '''
+    Plans a bulk_save() that stays within a memory limit (in bytes) from the
+    shape and dtype of the largest file, as recorded in the Inventory of its
+    directory, and the mediator's estimate() of the memory needed to encode
+    it. A worker process returns every document of a file at once, which
+    this process holds while they are inserted, so the number of workers is
+    reduced until that fits; with one worker, the documents are streamed
+    and, if the mediator's encode() has a chunk_option (e.g. chunk_steps),
+    the largest chunk that fits is chosen. Additional keyword arguments are
+    passed to the model. Returns a dictionary of the keyword arguments for
+    bulk_save() (encode_kwargs, workers), the estimated peak memory (peak),
+    the shape and dtype of the largest file (shape, dtype) and whether the
+    plan fits within the limit (fits).
+    '''
+    encode_kwargs = dict(encode_kwargs or {})
+    largest = None
+    directories = dict()
+    for path in paths:
+        directories.setdefault(os.path.dirname(path) or '.', []).append(path)
+
+    for directory, members in directories.items():
+        entries = Inventory(directory).refresh(model, members, **kwargs).entries
+        for path in members:
+            entry = entries.get(os.path.basename(path), {})
+            if entry.has_key('shape') and (largest is None or
+                    np.prod(entry['shape']) > np.prod(largest['shape'])):
+                largest = entry
+
+    plan = {
+        'dtype': None,
+        'encode_kwargs': encode_kwargs,
+        'fits': True,
+        'peak': None,
+        'shape': None,
+        'workers': workers
+    }
+
+    if largest is None:
+        return plan # Nothing could be read; the files will fail to load anyway
+
+    shape = tuple(largest['shape'])
+    itemsize = np.dtype(largest.get('dtype') or 'float64').itemsize
+    plan.update({'dtype': largest.get('dtype'), 'shape': shape})
+
+    per_file = mediator.estimate(shape, itemsize, materialize=True, **encode_kwargs)
+    if not mediator.parallel:
+        workers = 1 # See bulk_save()
+
+    while workers > 1 and (workers + 1) * per_file > memory_limit:
+        workers -= 1
+
+    if workers > 1:
+        plan.update({'peak': (workers + 1) * per_file, 'workers': workers})
+        return plan
+
+    option = mediator.chunk_option
+    if option is not None and hasattr(model, 'iter_extract'):
+        # The estimate grows with the chunk size; find the largest that fits
+        low, high = 1, shape[1]
+        while low < high:
+            middle = (low + high + 1) // 2
+            encode_kwargs[option] = middle
+            if mediator.estimate(shape, itemsize, **encode_kwargs) <= memory_limit:
+                low = middle
+
+            else:
+                high = middle - 1
+
+        encode_kwargs[option] = low
+
+    peak = mediator.estimate(shape, itemsize, **encode_kwargs)
+    plan.update({'fits': peak <= memory_limit, 'peak': peak, 'workers': 1})
+    return plan
+
 
 class Suite(object):
     def __init__(self):
         pass    
 
-    def get_listing(self, path=None, regex=None):
-        '''Gets a sequence of matching file paths'''
+    def get_listing(self, path=None, regex=None, start=None, end=None):
+        '''
+        Gets a sequence of matching file paths; if a start and/or end (ISO
+        8601 strings or datetime instances) are given, only those files with
+        data in that time range, as recorded in the directory's Inventory.
+        '''
         path = path or self.path
         regex = regex or self.file_matcher
         paths = []
@@ -18,8 +209,20 @@ class Suite(object):
             if regex.match(filename) is not None:
                 paths.append(os.path.join(path, filename))
 
+        if start is not None or end is not None:
+            return tuple(select_paths(paths, self.model, start, end))
+
         return tuple(paths)
 
+    def save_all(self, paths=None, workers=None, **kwargs):
+        '''
+        Saves each file in the listing (or the given paths) to the collection,
+        using a pool of worker processes; see bulk_save().
+        '''
+        return bulk_save(self.mediator, self.model, self.collection_name,
+            paths or self.get_listing(), workers or getattr(self, 'workers', 1),
+            **kwargs)
+
     def define_common_grid(self, model=None):
         '''Defines a common XY grid for multiple DataFrames'''
 
@@ -1,10 +1,13 @@
 #!/usr/bin/python
 
-import sys, getopt, copy, pprint, traceback, ast
+import sys, os, glob, getopt, copy, pprint, traceback, ast, time
+import numpy as np
 from pymongo import MongoClient
 from fluxpy import models
 from fluxpy import mediators
 from fluxpy.mediators import *
+from fluxpy.inventory import select_paths
+from fluxpy.utils import bulk_save, format_size, parse_size, plan_bulk_save
 
 usage_hdr = """
 manage.py [COMMAND] [REQUIRED ARGS FOR COMMAND] [OPTIONAL ARGS FOR COMMAND]
@@ -13,6 +16,8 @@ Commands:
 
     load                Loads data
     
+    inspect             Describes data files without loading them
+    
     remove              Removes data
     
     rename              Renames data collections
@@ -30,7 +35,9 @@ manage.py load
     Required arguments:
     
         -p, --path               Directory path of input file in Matlab (*.mat)
-                                 or HDF5 (*.h5 or *.mat) format 
+                                 or HDF5 (*.h5 or *.mat) format; may also be
+                                 a directory of such files or a quoted glob
+                                 pattern e.g. "./xco2/Kriged_2009*.mat"
                                  
         -n, --collection_name    Provide a unique name for the dataset by which
                                  it will be identified in the MongoDB
@@ -47,10 +54,36 @@ manage.py load
                                  Syntax: -o "parameter1=value1;parameter2=value2;parameter3=value3"
                                  e.g.: -o "title=MyData;gridres={'units':'degrees,'x':1.0,'y':1.0}"
     
+        -w, --workers            Number of worker processes that extract files
+                                 in parallel when loading multiple files
+                                 (default: 1); files that fail are reported
+                                 and skipped
+    
+        -s, --start              Load only the files with data on or after
+                                 this date/time (ISO 8601); see below
+    
+        -e, --end                Load only the files with data on or before
+                                 this date/time (ISO 8601); see below
+    
+        -M, --memory_limit       Peak memory to stay within e.g. 4G or 512M;
+                                 the number of workers and the chunk size
+                                 (e.g. time steps read at a time) are chosen
+                                 from the estimated memory use of the
+                                 largest file, and the plan is reported
+                                 before the load starts
+    
     Examples:
     
         python manage.py load -p ./data_casa_gfed.mat -m SpatioTemporalMatrix -n casa_gfed_2004
     
+        python manage.py load -p ./xco2/ -m KrigedXCO2Matrix -n xco2 -w 4
+    
+    With --start and/or --end, the time range of each file is looked up in
+    an inventory kept in its directory (.fluxpy_inventory.json); only files
+    that are new or have changed since they were last inventoried are opened:
+    
+        python manage.py load -p ./xco2/ -m XCO2Matrix -n xco2_jun -s 2009-06-01 -e 2009-06-30T23:59:59
+    
     In the following example, the program will look for a config file
     at ~/data_casa_gfed.json and overwrite the timestamp and var_name
     specifications in that file with those provided as command line args:
@@ -58,6 +91,37 @@ manage.py load
         python manage.py load -p ./data_casa_gfed.mat -m SpatioTemporalMatrix -n casa_gfed_2004 -o "timestamp=2003-12-22T03:00:00;var_name=casa_gfed_2004"
 """
 
+usage_inspect = """
+manage.py inspect
+
+    Usage:
+        manage.py inspect -p <filepath> -m <model> [OPTIONAL ARGS]
+        
+    Reads only the header and the coordinate columns of each file and prints
+    the variable name, shape, first and last dates and bounding box that
+    would be loaded; no data are written to the database.
+        
+    Required arguments:
+    
+        -p, --path               Path of input file, directory or quoted glob
+                                 pattern, as for the load command
+        
+        -m, --model              fluxpy/models.py model associated with the
+                                 input dataset  
+    
+    Optional arguments:
+    
+        -c, --config_file        Specify location of json config file. By
+                                 default, seeks input file w/ .json extension.
+    
+        -o, --options            Use to override specifications in the config
+                                 file, as for the load command
+    
+    Example:
+    
+        python manage.py inspect -p "./xco2/Kriged_2009*.mat" -m KrigedXCO2Matrix
+"""
+
 usage_remove = """
 manage.py remove
 
@@ -130,7 +194,7 @@ manage.py db
             python manage.py db -a
 """
 
-usage_all = ('\n' + '-'*30).join([usage_hdr,usage_load,usage_remove,usage_rename,usage_db])
+usage_all = ('\n' + '-'*30).join([usage_hdr,usage_load,usage_inspect,usage_remove,usage_rename,usage_db])
 
 # map of valid options (and whether or not they are required) for each command
 # -one current naivete: this setup assumes all boolean options are not required, which just happens to be the case (for now)
@@ -140,7 +204,16 @@ commands = {
                   'mediator': False,
                   'collection_name': True,
                   'options': False,
-                  'config_file': False},
+                  'config_file': False,
+                  'workers': False,
+                  'start': False,
+                  'end': False,
+                  'memory_limit': False},
+        
+        'inspect': {'path': True,
+                    'model': True,
+                    'options': False,
+                    'config_file': False},
             
         'remove': {'collection_name': True},
         
@@ -165,7 +238,11 @@ options = {'help': 'h',
            'options': 'o:',
            'include_counts': 'x',
            'list_ids': 'l:',
-           'audit': 'a'}
+           'audit': 'a',
+           'workers': 'w:',
+           'start': 's:',
+           'end': 'e:',
+           'memory_limit': 'M:'}
 
 # useful variables built from the options dict
 opt_pairs = [('--' + o[0], '-' + o[1].rstrip(':')) for o in options.items()]
@@ -173,6 +250,13 @@ bool_opts = [o for o in options if ':' not in options[o]]
 optstring_short = ''.join(options.values())
 optstring_long = [k + ('=' if ':' in options[k] else '') for k in options]
 
+# the mediator used for each model, unless another is given
+default_mediators = {'SpatioTemporalMatrix': mediators.Grid4DMediator,
+                     'XCO2Matrix': mediators.Unstructured3DMediator,
+                     'KrigedXCO2Matrix': mediators.Grid3DMediator,
+                     'CovarianceMatrix': mediators.CovarianceMediator,
+                     }
+
 def main(argv):
     """
     Parses command line options/arguments and reroutes to the appropriate
@@ -231,37 +315,113 @@ def main(argv):
     globals()['_' + command](**kwargs)
 
 
-def _load(path, model, collection_name, mediator=None, **kwargs):
+def _load(path, model, collection_name, mediator=None, workers=None,
+          start=None, end=None, memory_limit=None, **kwargs):
     """
     Uploads data to MongoDB using given model and mediator
     """
     
     # parse any config options into individual kwarg entries:
-    if kwargs['options']:
-        tmp = kwargs['options'].split(';')
+    kwargs.update(_parse_options(kwargs['options']))
+    
+    # now use mediator to save to db
+    if not mediator:
+        mediator = default_mediators[model]
+    else:
+        mediator = getattr(mediators, mediator)
+    
+    # load the data/instantiate the model for each file
+    paths = _expand_paths(path)
+    if start or end:
+        # only files in the time range, per the inventory of their directory
+        paths = select_paths(paths, getattr(models, model), start or None,
+                             end or None, **kwargs)
+        sys.stderr.write('Selected {0} file(s) with data from {1} to {2}\n'.format(len(paths),
+                         start or 'the beginning', end or 'the end'))
+    
+    workers = int(workers or 1)
+    encode_kwargs = {}
+    if memory_limit:
+        plan = plan_bulk_save(mediator(), getattr(models, model), paths,
+                              parse_size(memory_limit), workers, **kwargs)
+        workers, encode_kwargs = plan['workers'], plan['encode_kwargs']
+        sys.stderr.write('Memory plan: {0} file(s), the largest {1} {2}; {3} worker(s){4}; ' \
+                         'estimated peak {5} (limit {6})\n'.format(len(paths), plan['shape'],
+                         plan['dtype'], workers, ''.join([', {0}={1}'.format(*i) for i in encode_kwargs.items()]),
+                         format_size(plan['peak'] or 0), format_size(parse_size(memory_limit))))
+        if not plan['fits']:
+            sys.stderr.write('WARNING: The estimated peak exceeds the memory limit\n')
+    
+    failures = bulk_save(mediator(), getattr(models, model), collection_name,
+                         paths, workers=workers, encode_kwargs=encode_kwargs,
+                         verbose=True, **kwargs)
+    
+    if failures:
+        sys.stderr.write('\nFailed to load {0} of {1} file(s):\n'.format(len(failures), len(paths)))
+        for failed_path, error in failures:
+            sys.stderr.write('    {0}: {1}\n'.format(failed_path, error.strip().split('\n')[-1]))
+        
+        # The files that did load are kept; exit with an error all the same
+        sys.exit(1)
+    
+    sys.stderr.write('\nUpload complete!\n')
+
+def _inspect(path, model, **kwargs):
+    """
+    Prints a description of each file using only its header and coordinate
+    columns; nothing is loaded
+    """
+    kwargs.update(_parse_options(kwargs['options']))
+    
+    paths = _expand_paths(path)
+    failures = 0
+    start = time.time()
+    for each in paths:
+        try:
+            info = getattr(models, model)(each, **kwargs).inspect()
+        
+        except Exception, exc:
+            failures += 1
+            print '{0}: FAILED ({1})'.format(each, str(exc) or exc.__class__.__name__)
+            continue
+        
+        peak = default_mediators.get(model, mediators.Mediator)().estimate(info['shape'],
+            np.dtype(info['dtype']).itemsize)
+        print '{0}: {1} {2}, {3} to {4}, bbox {5}, est. peak {6} to load'.format(each,
+            info['var_name'], info['shape'], info['dates'][0], info['dates'][-1],
+            info.get('bbox'), format_size(peak))
+    
+    print '\nInspected {0} file(s) ({1} failed) in {2:.2f} seconds'.format(len(paths),
+        failures, time.time() - start)
+
+def _parse_options(options):
+    """
+    Parses config options given as "parameter1=value1;parameter2=value2"
+    into a dictionary
+    """
+    kwargs = {}
+    if options:
+        tmp = options.split(';')
         for o in tmp:
             tmp2 = o.split('=')
-            if tmp2[0] in ['timestamp','title','var_name']: # evaluate strings as strings
+            if tmp2[0] in ['timestamp','title','var_name','cache_dir']: # evaluate strings as strings
                 kwargs[tmp2[0]] = tmp2[1]
             else: # for dict/array values, evaluate string literally
                 kwargs[tmp2[0]] = ast.literal_eval(tmp2[1])
     
-    # load the data/instantiate the model
-    inst = getattr(models, model)(path=path,
-                                  collection_name=collection_name,
-                                  **kwargs)
-    
-    # now use mediator to save to db
-    default_mediators = {'SpatioTemporalMatrix': mediators.Grid4DMediator,
-                         'XCO2Matrix': mediators.Unstructured3DMediator,
-                         'KrigedXCO2Matrix': mediators.Grid3DMediator,
-                         }
-    
-    if not mediator:
-        mediator = default_mediators[model]
-    mediator().save(collection_name, inst, verbose=True)
+    return kwargs
+
+def _expand_paths(path):
+    """
+    Returns the sorted list of files for a path that may be a single file,
+    a directory of Matlab/HDF5 files, or a glob pattern
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.mat')) +
+                      glob.glob(os.path.join(path, '*.h5')))
     
-    sys.stderr.write('\nUpload complete!\n')
+    # a path that matches nothing is passed through so the model can complain
+    return sorted(glob.glob(path)) or [path]
 
 def _remove(collection_name):
     """
@@ -7,6 +7,8 @@ import numpy as np
 from shapely import wkt
 from shapely.geometry import shape
 from pymongo import MongoClient
+from fluxpy.covariance import quadratic_forms, region_weights
+from fluxpy.mediators import CovarianceMediator
 
 client = MongoClient() # Defaults: MongoClient('localhost', 27017)
 DB = 'fluxvis'
@@ -231,6 +233,35 @@ def get_state_cells(path=STATES_GEOMETRY):
     return state_assoc
     
 
+def uncertainty_by_state(covariance, chunk_rows=1000, mean=False, per_area=False):
+    '''
+    Calculates the uncertainty (variance) of the net (or, if mean is True,
+    the mean) flux per U.S. State, w'Cw for the weights w of each state's
+    model cells, from a covariance matrix of the model cells. The covariance
+    may be a CovarianceMatrix, a PackedCovariance or the name of a collection
+    saved by the CovarianceMediator; it is read one block of rows at a time,
+    once for all of the states. If per_area is True, the flux is normalized
+    by the area, as in flux_by_state().
+    '''
+    states = get_state_cells()
+    n = len(client[DB][INDEX_COLLECTION].find_one()['i'])
+
+    scale = None
+    if per_area:
+        # Convert sq. kilometers to sq. megameters
+        scale = dict([(s, (1000.0 * 1000.0) / STATE_AREAS[s]) for s in states])
+
+    names, weights = region_weights(states, n, mean=mean, scale=scale)
+
+    if isinstance(covariance, basestring):
+        blocks = CovarianceMediator().iter_blocks(covariance, chunk_rows)
+
+    else:
+        blocks = covariance.iter_blocks(chunk_rows)
+
+    return dict(zip(names, quadratic_forms(blocks, weights)))
+
+
 def view_sample_magnitudes():
     '''
     Generates a view of the data for the analyst to verify that there is no
@@ -12,15 +12,13 @@ class StanfordXCO2(Suite):
     file_matcher = re.compile(r'^XCO2_.*\.mat$')
     model = XCO2Matrix
     path = '/net/nas3/data/gis_lab/project/NASA_ACOS_Visualization/Data/xco2/'
+    workers = 4
 
     def __init__(self):
         self.mediator = Unstructured3DMediator()
 
     def main(self):
-        paths = self.get_listing()[0:10]
-        for path in paths:
-            instance = self.model(path)
-            self.mediator.save(self.collection_name, instance)
+        self.save_all(self.get_listing()[0:10], verbose=True)
 
 
 class StanfordKrigedXCO2(Suite):
@@ -37,39 +35,23 @@ class StanfordKrigedXCO2(Suite):
     file_matcher = re.compile(r'^Kriged.*\.mat$')
     model = KrigedXCO2Matrix
     path = '/net/nas3/data/gis_lab/project/NASA_ACOS_Visualization/Data/xco2/'
+    workers = 4
 
     def __init__(self):
         self.mediator = Grid3DMediator()
 
     def main(self):
-        '''Does a naive bulk insert (not optimized); supports alignment'''
+        '''Does a parallel bulk insert; supports alignment'''
 
         sys.stderr.write('\rDefining a common grid...\n')
         grid = self.define_common_grid()
 
         paths = self.get_listing()
-        i = 1
-        j = len(paths)
-        for path in paths:
-            instance = self.model(path)
+        failures = self.save_all(paths, encode_kwargs={'alignment': grid},
+            verbose=True)
 
-            try:
-                self.mediator.save(self.collection_name, instance, grid)
-
-            except AssertionError:
-                sys.stderr.write('\rSkipping error in %d of %d (%s)...' % (i, j, instance.timestamp))
-                i += 1
-                continue
-
-            except DuplicateKeyError:
-                sys.stderr.write('\rSkipping duplicate %d of %d (%s)...' % (i, j, instance.timestamp))
-                i += 1
-                continue
-
-            sys.stderr.write('\rSaving %d of %d (%s)...' % (i, j, instance.timestamp))
-            i += 1
-
-        sys.stderr.write('\rFinished saving %d records...' % j)
+        sys.stderr.write('\rFinished saving %d of %d records...'
+            % (len(paths) - len(failures), len(paths)))
 
 
 if __name__ == '__main__':
@@ -86,6 +68,7 @@ if __name__ == '__main__':
     elif sys.argv[1] == 'uncertainty':
         path = '/ws4/idata/fluxvis/casa_gfed_inversion_results/1.zerofull_casa_1pm_10twr/Month_Uncert1.mat'
         inst = CovarianceMatrix(path, timestamp='2008-01', span='1M')
+        mediator = CovarianceMediator().save('uncertainty', inst)
 
     elif sys.argv[1] == 'xco2':
         path = '/net/nas3/data/gis_lab/project/NASA_ACOS_Visualization/Data/xco2/XCO2_20090615_20090620.mat'